@@ -4,205 +4,245 @@
 # SPDX-License-Identifier: MIT-0
 
 import configparser
-import re
-import os
-import json
 import boto3
 import aws_cdk as cdk
-from aws_cdk import Aspects
+from aws_cdk import Aspects, cx_api
 
 from app_stacks.network_stack import NetworkStack
 from app_stacks.database_stack import DatabaseStack
+from app_stacks.image_stack import ImageStack
 from app_stacks.compute_stack import ComputeStack
 from app_stacks.cdn_stack import CdnStack
+from app_config.lookup_cache import LookupCache
+from app_config.nag_cache import NagCache, nag_mode, template_digest
+from app_config.parameters import AppParams, load_params
+from app_config.resolver import LookupResolver
+from app_config.timing import stopwatch
 
 from cdk_nag import AwsSolutionsChecks, NagSuppressions, NagPackSuppression
 
-session = boto3.session.Session()
-
-config = configparser.ConfigParser()
-config.read("parameters.properties")
-
-app = cdk.App()
-
-params = {}
-params["environment"] = app.node.try_get_context("env") or config["default"]["env"]
-params["app_name"] = app.node.try_get_context("app") or config["default"]["app"]
-env_config = params["app_name"] + "-" + params["environment"]
-
-params["aws_region"] = (
-    config[env_config]["awsRegion"] or os.environ["CDK_DEFAULT_REGION"]
-)
-params["aws_account"] = (
-    config[env_config]["awsAccount"] or os.environ["CDK_DEFAULT_ACCOUNT"]
-)
-
-# params["aws_region"] = config[env_config]["awsRegion"]
-# params["aws_account"] = config[env_config]["awsAccount"]
-params["hosted_zone"] = config[env_config]["hostedZone"]
-# derive the hosted_zone_id from the hosted_zone
-hosted_zone_json = os.popen(
-    'aws route53 list-hosted-zones-by-name --dns-name ' + params["hosted_zone"]
-).read()
-params["hosted_zone_id"] = str(
-    json.loads(hosted_zone_json)['HostedZones'][0]['Id']
-).replace('/hostedzone/', '')
-# get the cloudfront_prefix for the current region
-cloudfront_prefix_json = os.popen(
-    'aws ec2 describe-managed-prefix-lists --filter "Name"="prefix-list-name","Values"="com.amazonaws.global.cloudfront.origin-facing"'
-).read()
-params["cloudfront_prefix"] = json.loads(cloudfront_prefix_json)['PrefixLists'][0][
-    'PrefixListId'
-]
-params["vpc_cidr_block"] = config[env_config]["vpcCidrBlock"]
-params["nat_gateway_count"] = config[env_config]["natGatewayCount"]
-params["subdomain"] = config[env_config]["subdomain"]
-params["db_config"] = config[env_config]["dbConfig"]
-params["db_snapshot_id"] = config[env_config]["dbSnapshot"]
-params["db_engine"] = config[env_config]["dbEngine"]
-params["db_major_version"] = config[env_config]["dbMajorVersion"]
-params["db_full_version"] = config[env_config]["dbFullVersion"]
-params["db_instance_type"] = config[env_config]["dbInstanceType"]
-params["db_cluster_size"] = config[env_config]["dbClusterSize"]
-params["db_secret_name"] = config[env_config]["dbSecretName"]
-params["prevent_deletion"] = config[env_config]["preventDeletion"] == "yes"
-params["ami_parameter"] = config[env_config]["amiParameter"]
-params["admin_ips"] = config[env_config]["adminIps"].split(",")
-params["allowed_ips"] = config[env_config]["allowedIps"].split(",")
-params["efs_mount_dir"] = config[env_config]["efsMountDir"]
-params["efs_provisioned_throughput_mb"] = config[env_config][
-    "efsProvisionedThroughputMb"
-]
-params["target_port"] = config[env_config]["targetPort"]
-params["admin_user_data"] = json.loads(config[env_config]["adminUserData"])
-params["fleet_user_data"] = json.loads(config[env_config]["fleetUserData"])
-params["admin_user_data_script"] = config[env_config]["adminUserDataScript"]
-params["fleet_user_data_script"] = config[env_config]["fleetUserDataScript"]
-params["managed_waf_rules"] = json.loads(config[env_config]["managedWafRules"])
-params["uncached_paths"] = json.loads(config[env_config]["uncachedPaths"])
-params["forwarded_cookies"] = json.loads(config[env_config]["forwardedCookies"])
-params["min_max_admin_instances"] = json.loads(
-    config[env_config]["minMaxAdminInstances"]
-)
-params["min_max_fleet_instances"] = json.loads(
-    config[env_config]["minMaxFleetInstances"]
-)
-params["admin_instance_type"] = config[env_config]["adminInstanceType"]
-params["fleet_instance_type"] = config[env_config]["fleetInstanceType"]
-params["admin_build_time"] = config[env_config]["adminBuildTime"]
-params["fleet_build_time"] = config[env_config]["fleetBuildTime"]
-deploy_environment = cdk.Environment(
-    region=params["aws_region"], account=params["aws_account"]
-)
-
-global_environment = cdk.Environment(region="us-east-1", account=params["aws_account"])
-
-# derive site_url
-dns_pattern = re.compile(r'^[a-zA-Z]+[a-zA-Z\d-]{,62}')
-if "subdomain" in params and re.search(dns_pattern, params["subdomain"]) != None:
-    params["site_hostname"] = params["subdomain"] + "." + params["hosted_zone"]
-else:
-    params["site_hostname"] = (
-        params["app_name"] + "-" + params["environment"] + "." + params["hosted_zone"]
-    )
 
-# The param we will write to the parameter store in us-east-1
-params["alb_hostname_param"] = (
-    "/" + params["app_name"] + "/" + params["environment"] + "/" + "alb-hostname"
-)
-params["cloudfront_secret_param"] = (
-    "/" + params["app_name"] + "/" + params["environment"] + "/" + "cloudfront-secret"
-)
-
-# use standardised stack names so we can use them to resolve cross-stack cloudformation imports
-network_stack = NetworkStack(
-    app,
-    params["app_name"] + "-" + params["environment"] + "-network-stack",
-    params=params,
-    env=deploy_environment,
-)
-
-db_secret_name = params["db_secret_name"] or ""
-
-if (
-    params["db_config"] == "instance"
-    or params["db_config"] == "cluster"
-    or params["db_config"] == "none"
-):
-    database_stack = DatabaseStack(
-        app,
-        params["app_name"] + "-" + params["environment"] + "-database-stack",
-        params=params,
-        env=deploy_environment,
+def build_app(
+    app: cdk.App,
+    params: AppParams,
+    lookups: dict,
+    nag=True,
+    timings: dict = None,
+) -> None:
+    """Add the stacks for one app/env to app.
+
+    nag is True to add the cdk-nag rule packs to every stack, False to skip
+    them, or a set of the stack names to check. If timings is a dict the time
+    taken to build each stack is recorded in it, keyed by stack name.
+    """
+    params = params.with_lookups(lookups)
+
+    def add_checks(stack):
+        if nag is True or (nag and stack.stack_name in nag):
+            Aspects.of(stack).add(AwsSolutionsChecks())
+
+    deploy_environment = cdk.Environment(
+        region=params.aws_region, account=params.aws_account
     )
-    Aspects.of(database_stack).add(AwsSolutionsChecks())
-    if params["db_config"] != "delete" and params["db_config"] != "none":
-        db_secret_name = database_stack.db.secret.secret_name
-
-compute_stack = ComputeStack(
-    app,
-    params["app_name"] + "-" + params["environment"] + "-compute-stack",
-    vpc=network_stack.vpc,
-    instance_sg=network_stack.instance_security_group,
-    alb_sg=network_stack.alb_security_group,
-    db_secret_name=db_secret_name,
-    params=params,
-    env=deploy_environment,
-)
-
-if db_secret_name != "":
-    compute_stack.add_dependency(database_stack)
-
-# try fetching params["alb_hostname_param"] from us-east-1 and if it's there we can synth this stack
-try:
-    ssm_client = session.client(
-        service_name='ssm',
-        region_name='us-east-1',
+
+    global_environment = cdk.Environment(
+        region="us-east-1", account=params.aws_account
     )
-    alb_hostname_param = ssm_client.get_parameter(Name=params["alb_hostname_param"])
-    if 'Parameter' in alb_hostname_param:
-        cdn_stack = CdnStack(
+
+    # use standardised stack names so we can use them to resolve cross-stack cloudformation imports
+    with stopwatch(timings, params.network_stack_name):
+        network_stack = NetworkStack(
             app,
-            params["app_name"] + "-" + params["environment"] + "-cdn-stack",
+            params.network_stack_name,
             params=params,
-            env=global_environment,
-        ).add_dependency(compute_stack)
-        # can't add the solutions check unless compute stack is present
-        # as unless it is cdn_stack will == None
-        if cdn_stack != None:
-            Aspects.of(cdn_stack).add(AwsSolutionsChecks())
-except Exception as e:
-    if str(e).find("ParameterNotFound") != -1:
+            env=deploy_environment,
+        )
+
+    db_secret_name = params.db_secret_name
+    db_host_param = ""
+    db_read_host_param = ""
+    database_stack = None
+
+    if (
+        params.db_config == "instance"
+        or params.db_config == "cluster"
+        or params.db_config == "none"
+    ):
+        with stopwatch(timings, params.database_stack_name):
+            database_stack = DatabaseStack(
+                app,
+                params.database_stack_name,
+                params=params,
+                env=deploy_environment,
+            )
+        add_checks(database_stack)
+        if params.db_config != "delete" and params.db_config != "none":
+            db_secret_name = database_stack.db.secret.secret_name
+            db_host_param = params.db_host_param
+            db_read_host_param = params.db_read_host_param
+
+    image_stack = None
+    if params.image_build_commands:
+        with stopwatch(timings, params.image_stack_name):
+            image_stack = ImageStack(
+                app,
+                params.image_stack_name,
+                vpc=network_stack.vpc,
+                instance_sg=network_stack.instance_security_group,
+                params=params,
+                env=deploy_environment,
+            )
+        add_checks(image_stack)
+
+    with stopwatch(timings, params.compute_stack_name):
+        compute_stack = ComputeStack(
+            app,
+            params.compute_stack_name,
+            vpc=network_stack.vpc,
+            instance_sg=network_stack.instance_security_group,
+            alb_sg=network_stack.alb_security_group,
+            db_secret_name=db_secret_name,
+            params=params,
+            cache_sg=network_stack.cache_security_group,
+            db_host_param=db_host_param,
+            db_read_host_param=db_read_host_param,
+            env=deploy_environment,
+        )
+
+    if db_secret_name != "" and database_stack != None:
+        compute_stack.add_dependency(database_stack)
+    if image_stack != None:
+        compute_stack.add_dependency(image_stack)
+
+    # if params.alb_hostname_param is in us-east-1 we can synth this stack
+    if lookups["alb_hostname"] == None:
         print(
-            "Not synthing CDN stack as the parameter {} was not found in us-east-1. It will get created once you have deployed the compute stack.".format(
-                params["alb_hostname_param"]
+            "Not synthing CDN stack as the parameter {} was not found or could not be read in us-east-1. It will get created once you have deployed the compute stack.".format(
+                params.alb_hostname_param
             )
         )
     else:
-        print(e)
-
-Aspects.of(network_stack).add(AwsSolutionsChecks())
-Aspects.of(compute_stack).add(AwsSolutionsChecks())
-# have to suppress some nags at stack level because the resources that
-# are flagged are generated inside L2 constructs
-NagSuppressions.add_stack_suppressions(
-    compute_stack,
-    suppressions=[
-        NagPackSuppression(
-            id='AwsSolutions-L1', reason='Lambda created by embedded library'
-        ),
-        NagPackSuppression(id='AwsSolutions-IAM4', reason='CDK-generated policy'),
-        NagPackSuppression(id='AwsSolutions-IAM5', reason='CDK-generated IAM entity'),
-    ],
-)
-NagSuppressions.add_stack_suppressions(
-    database_stack,
-    suppressions=[
-        NagPackSuppression(id='AwsSolutions-SMG4', reason='CDK-generated secret'),
-    ],
-)
-
-Aspects.of(app).add(cdk.Tag("CreatedBy", "guymor@amazon.com"))
-# add more tags here
-
-app.synth()
+        with stopwatch(timings, params.cdn_stack_name):
+            cdn_stack = CdnStack(
+                app,
+                params.cdn_stack_name,
+                params=params,
+                env=global_environment,
+            )
+        cdn_stack.add_dependency(compute_stack)
+        add_checks(cdn_stack)
+
+    add_checks(network_stack)
+    add_checks(compute_stack)
+    # have to suppress some nags at stack level because the resources that
+    # are flagged are generated inside L2 constructs
+    NagSuppressions.add_stack_suppressions(
+        compute_stack,
+        suppressions=[
+            NagPackSuppression(
+                id='AwsSolutions-L1', reason='Lambda created by embedded library'
+            ),
+            NagPackSuppression(
+                id='AwsSolutions-IAM4', reason='CDK-generated policy'
+            ),
+            NagPackSuppression(
+                id='AwsSolutions-IAM5', reason='CDK-generated IAM entity'
+            ),
+        ],
+    )
+    if image_stack != None:
+        NagSuppressions.add_stack_suppressions(
+            image_stack,
+            suppressions=[
+                NagPackSuppression(
+                    id='AwsSolutions-L1', reason='Same runtime as the compute stack'
+                ),
+                NagPackSuppression(
+                    id='AwsSolutions-IAM4',
+                    reason='AWS managed policies for Image Builder and Lambda',
+                ),
+                NagPackSuppression(
+                    id='AwsSolutions-IAM5',
+                    reason='Image build versions are not known in advance',
+                ),
+            ],
+        )
+    if database_stack != None:
+        NagSuppressions.add_stack_suppressions(
+            database_stack,
+            suppressions=[
+                NagPackSuppression(
+                    id='AwsSolutions-SMG4', reason='CDK-generated secret'
+                ),
+            ],
+        )
+
+    Aspects.of(app).add(cdk.Tag("CreatedBy", "guymor@amazon.com"))
+    # add more tags here
+
+
+def main(context: dict = None, outdir: str = None, session=None):
+    config = configparser.ConfigParser()
+    config.read("parameters.properties")
+
+    app = cdk.App(context=context, outdir=outdir)
+    lookup_cache = LookupCache.from_context(app.node)
+
+    params = load_params(
+        config,
+        app.node.try_get_context("app") or config["default"]["app"],
+        app.node.try_get_context("env") or config["default"]["env"],
+    )
+
+    # resolve the hosted zone ID, the cloudfront_prefix for the current region and
+    # whether params.alb_hostname_param exists in us-east-1 in one concurrent pass
+    resolver = LookupResolver(
+        session=session or boto3.session.Session(), cache=lookup_cache
+    )
+    lookups = resolver.resolve(resolver.app_lookups(params))
+    if app.node.try_get_context("report-lookups"):
+        print(resolver.report())
+
+    mode = nag_mode(app.node)
+    build_app(app, params, lookups, nag=mode == "on")
+    lookup_cache.save()
+    assembly = app.synth()
+    if mode == "cached":
+        assembly = check_changed_stacks(assembly, params, lookups, context, outdir)
+    return assembly
+
+
+def check_changed_stacks(
+    assembly, params: AppParams, lookups: dict, context: dict, outdir: str
+):
+    """Run cdk-nag on the stacks whose templates haven't passed it before."""
+    nag_cache = NagCache()
+    changed = {}
+    for stack in assembly.stacks:
+        digest = template_digest(stack.template_full_path)
+        if not nag_cache.passed(stack.stack_name, digest):
+            changed[stack.stack_name] = digest
+    if not changed:
+        return assembly
+
+    # synth again with the rule packs on the changed stacks only, the
+    # templates are the same with or without them
+    app = cdk.App(context=context, outdir=outdir)
+    build_app(app, params, lookups, nag=set(changed))
+    assembly = app.synth()
+    for stack_name, digest in changed.items():
+        errors = [
+            message
+            for message in assembly.get_stack_by_name(stack_name).messages
+            if message.level == cx_api.SynthesisMessageLevel.ERROR
+        ]
+        if errors:
+            nag_cache.forget(stack_name)
+        else:
+            nag_cache.record(stack_name, digest)
+    nag_cache.save()
+    return assembly
+
+
+if __name__ == "__main__":
+    main()
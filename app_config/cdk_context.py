@@ -0,0 +1,16 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import os
+
+
+def load_context() -> dict:
+    """The context the cdk CLI would pass to app.py, for running it without the CLI."""
+    context = {}
+    for file_name, key in (("cdk.json", "context"), ("cdk.context.json", None)):
+        if os.path.exists(file_name):
+            with open(file_name, "r") as context_file:
+                values = json.load(context_file)
+            context.update(values[key] if key else values)
+    return context
@@ -0,0 +1,89 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Generates the viewer request CloudFront Function for a stanza from
+# cloudfront_function/viewer_request.js. To see, or test, the code that
+# would be deployed:
+#
+#   python3 -m app_config.edge_function wp-dev > /tmp/wp-dev.js
+#   node cloudfront_function/harness.js --code /tmp/wp-dev.js my-cases.json
+
+import configparser
+import ipaddress
+import json
+import os
+import sys
+from os import path
+
+from app_config.parameters import AppParams, ParameterError, load_params
+
+TEMPLATE = path.join(
+    path.dirname(path.dirname(path.abspath(__file__))),
+    "cloudfront_function",
+    "viewer_request.js",
+)
+# the CloudFront Functions limit
+MAX_CODE_SIZE = 10 * 1024
+
+
+def edge_function_config(params: AppParams) -> dict:
+    admin_ips = []
+    admin_networks = []
+    for ip in params.admin_ips:
+        try:
+            network = ipaddress.ip_network(ip, strict=False)
+        except ValueError as e:
+            raise ParameterError("adminIps: " + str(e))
+        if network.version == 4:
+            # [network, netmask] as unsigned 32 bit numbers
+            admin_networks.append(
+                [int(network.network_address), int(network.netmask)]
+            )
+        else:
+            # like the ALB rule, IPv6 addresses have to match exactly
+            admin_ips.append(str(network.network_address))
+
+    return {
+        "adminPaths": params.admin_paths,
+        "adminIps": admin_ips,
+        "adminNetworks": admin_networks,
+        # the function always sets true-client-ip, so never trust the viewer's
+        "strippedHeaders": sorted(set(params.stripped_headers + ["true-client-ip"])),
+        "strippedQueryStrings": [
+            name.lower() for name in params.stripped_query_strings
+        ],
+        "redirects": params.edge_redirects,
+        "trailingSlash": params.trailing_slash,
+        "lowercaseHost": params.lowercase_host,
+    }
+
+
+def render(config: dict) -> str:
+    with open(TEMPLATE, "r") as template_file:
+        template = template_file.read()
+    return template.replace(
+        "var config = CONFIG;", "var config = " + json.dumps(config) + ";"
+    )
+
+
+def viewer_request_code(params: AppParams) -> str:
+    code = render(edge_function_config(params))
+    if len(code.encode("utf-8")) > MAX_CODE_SIZE:
+        raise ParameterError(
+            "the viewer request function for {} is over the {} byte limit for "
+            "CloudFront Functions, try fewer edgeRedirects".format(
+                params.name_prefix, MAX_CODE_SIZE
+            )
+        )
+    return code
+
+
+if __name__ == "__main__":
+    config = configparser.ConfigParser()
+    config.read("parameters.properties")
+    app_name, environment = sys.argv[1].rsplit("-", 1)
+    # the function doesn't depend on the account or region, so stanzas that
+    # leave them to the cdk CLI can be generated without it
+    os.environ.setdefault("CDK_DEFAULT_ACCOUNT", "000000000000")
+    os.environ.setdefault("CDK_DEFAULT_REGION", "us-east-1")
+    print(viewer_request_code(load_params(config, app_name, environment)))
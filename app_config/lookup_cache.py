@@ -0,0 +1,165 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Persistent cache for the AWS lookups app.py performs before it can build
+# the stacks (hosted zone ID, CloudFront prefix list, us-east-1 parameters).
+# Entries are keyed by account/region/query and expire after a TTL, so
+# repeated synths of the same environment are pure local computation.
+#
+#   cdk synth -c refresh-lookups=true    re-run every lookup and store the results
+#   cdk synth -c offline-lookups=true    never call AWS, fail if an entry is missing
+#   python3 -m app_config.lookup_cache list|clear [--account ...] [--region ...]
+
+import argparse
+import json
+import os
+import time
+
+CACHE_FILE = "cdk.lookups.json"
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+
+class LookupCacheMiss(Exception):
+    pass
+
+
+def _flag(value):
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
+class LookupCache:
+    def __init__(
+        self,
+        path: str = CACHE_FILE,
+        ttl: int = DEFAULT_TTL_SECONDS,
+        offline: bool = False,
+        refresh: bool = False,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.offline = offline
+        self.refresh = refresh
+        self._dirty = False
+        self._entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as cache_file:
+                self._entries = json.load(cache_file)
+
+    @classmethod
+    def from_context(cls, node, path: str = CACHE_FILE):
+        # context values (-c key=value) win over environment variables
+        def setting(context_key, env_key, default):
+            value = node.try_get_context(context_key)
+            if value is None:
+                value = os.environ.get(env_key, default)
+            return value
+
+        return cls(
+            path=path,
+            ttl=int(
+                setting("lookup-cache-ttl", "CDK_LOOKUP_CACHE_TTL", DEFAULT_TTL_SECONDS)
+            ),
+            offline=_flag(setting("offline-lookups", "CDK_LOOKUP_OFFLINE", "")),
+            refresh=_flag(setting("refresh-lookups", "CDK_LOOKUP_REFRESH", "")),
+        )
+
+    @staticmethod
+    def key(account: str, region: str, query: str) -> str:
+        return account + ":" + region + ":" + query
+
+    def peek(self, account: str, region: str, query: str):
+        """Return (True, value) for a usable cached entry, otherwise (False, None).
+
+        In offline mode a missing entry raises LookupCacheMiss instead.
+        """
+        key = self.key(account, region, query)
+        entry = self._entries.get(key)
+        if entry is not None and not self.refresh:
+            if self.offline:
+                return True, entry["value"]
+            # "not found" results are always looked up again when online
+            if (
+                entry["value"] is not None
+                and time.time() - entry["timestamp"] < self.ttl
+            ):
+                return True, entry["value"]
+        if self.offline:
+            raise LookupCacheMiss(
+                "No cached value for {} and offline lookups are enabled. Run a synth with -c refresh-lookups=true to populate {}".format(
+                    key, self.path
+                )
+            )
+        return False, None
+
+    def get(self, account: str, region: str, query: str, fetch):
+        """Return the cached value for the query, calling fetch() on a miss.
+
+        A fetch() result of None means "not found". It is stored so offline
+        synths can use it, but resources that don't exist yet are looked up
+        again on the next online synth.
+        """
+        hit, value = self.peek(account, region, query)
+        if hit:
+            return value
+        value = fetch()
+        self.put(account, region, query, value)
+        return value
+
+    def put(self, account: str, region: str, query: str, value) -> None:
+        self._entries[self.key(account, region, query)] = {
+            "value": value,
+            "timestamp": time.time(),
+        }
+        self._dirty = True
+
+    def entries(self):
+        return sorted(self._entries.items())
+
+    def clear(self, account: str = None, region: str = None) -> int:
+        removed = 0
+        for key in list(self._entries):
+            entry_account, entry_region, _ = key.split(":", 2)
+            if (account is None or account == entry_account) and (
+                region is None or region == entry_region
+            ):
+                del self._entries[key]
+                removed = removed + 1
+        self._dirty = self._dirty or removed > 0
+        return removed
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        # write to a temp file and rename so concurrent readers never see a partial file
+        tmp_path = self.path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_path, "w") as cache_file:
+            json.dump(self._entries, cache_file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the synth-time lookup cache")
+    parser.add_argument("command", choices=["list", "clear"])
+    parser.add_argument("--account")
+    parser.add_argument("--region")
+    parser.add_argument("--file", default=CACHE_FILE)
+    args = parser.parse_args()
+
+    cache = LookupCache(path=args.file)
+    if args.command == "list":
+        now = time.time()
+        for key, entry in cache.entries():
+            age = int(now - entry["timestamp"])
+            print("{} = {} (age {}s)".format(key, entry["value"], age))
+    else:
+        print(
+            "Removed {} entries from {}".format(
+                cache.clear(account=args.account, region=args.region), args.file
+            )
+        )
+        cache.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# How app.py applies the cdk-nag AwsSolutions rule pack, chosen with the
+# "nag" context key or the CDK_NAG_MODE environment variable:
+#
+#   on      check every stack on every synth (the default)
+#   off     skip the rule packs, for a fast inner-loop synth while iterating
+#   cached  only check stacks whose template changed since they last passed
+#
+# In cached mode the stacks that passed are recorded in cdk.nag.json, keyed
+# by a hash of their synthesized template and the cdk-nag version. Stack
+# suppressions are added in every mode so the templates are the same either
+# way and the hashes stay comparable.
+#
+#   cdk synth -c nag=off
+#   CDK_NAG_MODE=cached cdk synth
+
+import hashlib
+import json
+import os
+from importlib import metadata
+
+CACHE_FILE = "cdk.nag.json"
+NAG_MODES = ("on", "off", "cached")
+
+
+def nag_mode(node) -> str:
+    # context values (-c nag=...) win over the environment variable
+    mode = node.try_get_context("nag")
+    if mode is None:
+        mode = os.environ.get("CDK_NAG_MODE", "on")
+    mode = str(mode).lower()
+    if mode not in NAG_MODES:
+        raise ValueError(
+            "nag mode must be one of {}, not {!r}".format(", ".join(NAG_MODES), mode)
+        )
+    return mode
+
+
+def template_digest(template_path: str) -> str:
+    with open(template_path, "rb") as template_file:
+        return hashlib.sha256(template_file.read()).hexdigest()
+
+
+def _rules_version() -> str:
+    try:
+        return metadata.version("cdk-nag")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+class NagCache:
+    def __init__(self, path: str = CACHE_FILE, rules_version: str = None) -> None:
+        self.path = path
+        self.rules_version = rules_version or _rules_version()
+        self._changes = {}
+        self._passed = self._load()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as cache_file:
+            contents = json.load(cache_file)
+        # a different cdk-nag release may have different rules, so start over
+        if contents.get("rules_version") != self.rules_version:
+            return {}
+        return contents.get("passed", {})
+
+    def passed(self, stack_name: str, digest: str) -> bool:
+        return self._passed.get(stack_name) == digest
+
+    def record(self, stack_name: str, digest: str) -> None:
+        self._passed[stack_name] = digest
+        self._changes[stack_name] = digest
+
+    def forget(self, stack_name: str) -> None:
+        self._passed.pop(stack_name, None)
+        self._changes[stack_name] = None
+
+    def save(self) -> None:
+        if not self._changes:
+            return
+        # merge into what is on disk now, synth_all.py may run several synths at once
+        passed = self._load()
+        for stack_name, digest in self._changes.items():
+            if digest is None:
+                passed.pop(stack_name, None)
+            else:
+                passed[stack_name] = digest
+        tmp_path = self.path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_path, "w") as cache_file:
+            json.dump(
+                {"rules_version": self.rules_version, "passed": passed},
+                cache_file,
+                indent=2,
+                sort_keys=True,
+            )
+        os.replace(tmp_path, self.path)
+        self._changes = {}
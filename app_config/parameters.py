@@ -0,0 +1,693 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Reads one [app-env] stanza of parameters.properties into the AppParams
+# model used by the stacks. Everything is parsed, validated and derived here,
+# once, so a bad value fails before any lookups or constructs are created.
+# This module deliberately doesn't import aws_cdk so it can be used without
+# paying for the jsii runtime startup.
+
+import json
+import os
+import re
+from dataclasses import dataclass, replace
+from os import path
+
+from app_config.tuning import instance_resources, profile_for
+
+DB_CONFIGS = ("", "instance", "cluster", "none")
+TRAILING_SLASHES = ("", "add", "remove")
+DB_ENGINES = ("mysql", "postgres")
+CACHE_ENGINES = ("", "redis", "valkey")
+WARM_POOL_STATES = ("", "stopped", "hibernated", "running")
+EFS_THROUGHPUT_MODES = ("elastic", "provisioned", "bursting")
+EFS_PERFORMANCE_MODES = ("general_purpose", "max_io")
+# the most RAM EC2 can hibernate on Linux
+HIBERNATION_MAX_MEMORY_MB = 150 * 1024
+
+
+class ParameterError(ValueError):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class AppParams:
+    app_name: str
+    environment: str
+    aws_region: str
+    aws_account: str
+    # networking & dns
+    hosted_zone: str
+    subdomain: str
+    site_hostname: str
+    vpc_cidr_block: str
+    nat_gateway_count: int
+    admin_ips: list
+    allowed_ips: list
+    # database
+    db_config: str
+    db_snapshot_id: str
+    db_engine: str
+    db_major_version: str
+    db_full_version: str
+    db_instance_type: str
+    db_cluster_size: int
+    # [min,max] Aurora replicas, None to keep the cluster at db_cluster_size
+    db_replica_min_max: list
+    db_replica_cpu_target: int
+    db_replica_connections_target: int
+    db_secret_name: str
+    db_port: int
+    db_proxy: bool
+    prevent_deletion: bool
+    # object cache, cache_engine == "" means no cache tier
+    cache_engine: str
+    cache_node_type: str
+    cache_nodes: int
+    cache_port: int
+    # compute
+    ami_parameter: str
+    # commands baked into an AMI by the image stack, [] for no image stack
+    image_build_commands: list
+    image_rebuild_schedule: str
+    efs_mount_dir: str
+    # efs_provisioned_throughput_mb is only set with "provisioned"
+    efs_throughput_mode: str
+    efs_provisioned_throughput_mb: int
+    efs_performance_mode: str
+    # an access point for each ASG, rooted at efs_access_point_path, with
+    # efs_posix_user [uid, gid] if any
+    efs_access_points: bool
+    efs_access_point_path: str
+    efs_posix_user: list
+    target_port: int
+    admin_user_data: list
+    fleet_user_data: list
+    admin_user_data_script: str
+    fleet_user_data_script: str
+    min_max_admin_instances: list
+    min_max_fleet_instances: list
+    admin_instance_type: str
+    fleet_instance_type: str
+    # a mixed instances policy for the fleet, if fleet_mixed_instances
+    fleet_extra_instance_types: list
+    fleet_on_demand_base: int
+    fleet_on_demand_percentage: int
+    fleet_mixed_instances: bool
+    # Apache/PHP-FPM/OPcache settings for user data, see app_config/tuning.py
+    admin_tuning: dict
+    fleet_tuning: dict
+    # directories under fleet_app_dir the fleet preloads into OPcache
+    fleet_opcache_preload: list
+    # run the fleet from a local copy of EFS at fleet_app_dir, kept in sync
+    # by fleet_sync_user, if fleet_local_sync
+    fleet_local_sync: bool
+    fleet_app_dir: str
+    fleet_sync_user: str
+    fleet_sync_exclude: list
+    # files under efs_mount_dir that run app-publish when the admin changes
+    # them, and whether the fleet hears of it from an SSM parameter change
+    # or by polling the marker on EFS. with neither, it isn't told
+    admin_publish_watch: list
+    publish_events: bool
+    fleet_refresh_watch: bool
+    code_version_parameter: str
+    admin_build_time: int
+    fleet_build_time: int
+    # warm pool state for each ASG, "" for no warm pool
+    admin_warm_pool: str
+    admin_warm_pool_size: int
+    fleet_warm_pool: str
+    fleet_warm_pool_size: int
+    # fleet scaling policies, None/[] for none
+    fleet_requests_per_target: int
+    fleet_cpu_target: int
+    fleet_scheduled_scaling: list
+    # cloudfront/WAF
+    managed_waf_rules: list
+    uncached_paths: list
+    static_paths: list
+    static_ttl_days: int
+    static_query_strings: list
+    # the cache key for everything else, ["*"] for every query string but
+    # cache_query_strings_deny, and the names (or name* prefixes) stripped
+    # from viewer requests before the cache lookup
+    cache_query_strings: list
+    cache_query_strings_deny: list
+    stripped_query_strings: list
+    # the rest of the viewer request function, see app_config/edge_function.py
+    admin_paths: list
+    edge_redirects: dict
+    stripped_headers: list
+    trailing_slash: str
+    lowercase_host: bool
+    # S3 bucket for media served by CloudFront, if media_bucket
+    media_bucket: bool
+    media_path: str
+    media_bucket_name: str
+    forwarded_cookies: list
+    # batched CloudFront invalidations queued by the admin instance
+    cdn_invalidation: bool
+    invalidation_window: int
+    invalidation_max_paths: int
+    invalidation_queue_name: str
+    # the ALB origin, origin_shield_region "" for no origin shield
+    origin_shield_region: str
+    origin_read_timeout: int
+    origin_keepalive_timeout: int
+    origin_connection_attempts: int
+    origin_connection_timeout: int
+    # derived names, eg "wp-dev" and "WpDev"
+    name_prefix: str
+    resource_prefix: str
+    network_stack_name: str
+    database_stack_name: str
+    image_stack_name: str
+    compute_stack_name: str
+    cdn_stack_name: str
+    db_secret_param: str
+    db_host_param: str
+    db_read_host_param: str
+    image_ami_param: str
+    # the params we will write to the parameter store in us-east-1
+    alb_hostname_param: str
+    cloudfront_secret_param: str
+    # filled in from the synth-time lookups, see app_config/resolver.py
+    hosted_zone_id: str = ""
+    cloudfront_prefix: str = ""
+
+    def with_lookups(self, lookups: dict):
+        return replace(
+            self,
+            hosted_zone_id=lookups["hosted_zone_id"],
+            cloudfront_prefix=lookups["cloudfront_prefix"],
+        )
+
+
+def environment_sections(config) -> list:
+    """The (section, app_name, environment) stanzas in a parsed properties file."""
+    sections = []
+    for section in config.sections():
+        if section == "default":
+            continue
+        if "-" not in section:
+            raise ParameterError(
+                "[{}] is not an [app-env] stanza, eg [wp-dev]".format(section)
+            )
+        app_name, environment = section.rsplit("-", 1)
+        sections.append((section, app_name, environment))
+    return sections
+
+
+class _Stanza:
+    """Typed accessors for one stanza that report errors with the key name."""
+
+    def __init__(self, config, section: str) -> None:
+        if not config.has_section(section):
+            raise ParameterError(
+                "There is no [{}] stanza in parameters.properties".format(section)
+            )
+        self.section = section
+        self.values = config[section]
+
+    def error(self, key: str, message: str) -> ParameterError:
+        return ParameterError(
+            "[{}] {}={!r}: {}".format(
+                self.section, key, self.values.get(key, ""), message
+            )
+        )
+
+    def text(self, key: str, default: str = None) -> str:
+        if key not in self.values:
+            if default is None:
+                raise ParameterError(
+                    "[{}] is missing the {} setting".format(self.section, key)
+                )
+            return default
+        return self.values[key].strip()
+
+    def choice(self, key: str, choices: tuple, default: str = None) -> str:
+        value = self.text(key, default)
+        if value not in choices:
+            raise self.error(
+                key, "must be one of " + ", ".join(map(repr, choices))
+            )
+        return value
+
+    def number(
+        self, key: str, default: int = None, minimum: int = 0, maximum: int = None
+    ) -> int:
+        value = self.text(key, None if default is None else str(default))
+        try:
+            number = int(value)
+        except ValueError:
+            raise self.error(key, "must be a whole number")
+        if number < minimum:
+            raise self.error(key, "must be at least " + str(minimum))
+        if maximum is not None and number > maximum:
+            raise self.error(key, "must be at most " + str(maximum))
+        return number
+
+    def optional_number(self, key: str, minimum: int = 1) -> int:
+        if self.text(key, "") == "":
+            return None
+        return self.number(key, minimum=minimum)
+
+    def yes_no(self, key: str, default: str = None) -> bool:
+        return self.choice(key, ("yes", "no"), default) == "yes"
+
+    def csv(self, key: str, default: str = None) -> list:
+        return [value.strip() for value in self.text(key, default).split(",")]
+
+    def parsed(self, key: str, expected_type=list, default: str = None):
+        try:
+            value = json.loads(self.text(key, default))
+        except ValueError as e:
+            raise self.error(key, "is not valid JSON ({})".format(e))
+        if not isinstance(value, expected_type):
+            raise self.error(key, "must be a JSON " + expected_type.__name__)
+        return value
+
+    def min_max(self, key: str, default: str = None) -> list:
+        value = self.parsed(key, default=default)
+        if (
+            len(value) != 2
+            or not all(isinstance(number, int) for number in value)
+            or value[0] < 0
+            or value[0] > value[1]
+        ):
+            raise self.error(key, "must be [min,max] with 0 <= min <= max")
+        return value
+
+    def optional_min_max(self, key: str) -> list:
+        if self.text(key, "") == "":
+            return None
+        return self.min_max(key)
+
+    def scheduled_actions(self, key: str, default: str = None) -> list:
+        actions = self.parsed(key, default=default)
+        for action in actions:
+            if (
+                not isinstance(action, dict)
+                or len(str(action.get("cron", "")).split()) != 5
+                or not set(action) <= {"cron", "min", "max", "desired", "timezone"}
+                or not all(
+                    isinstance(action.get(size, 0), int)
+                    for size in ("min", "max", "desired")
+                )
+            ):
+                raise self.error(
+                    key,
+                    'each action must be like {"cron": "0 8 * * MON-FRI", "min": 2}'
+                    ' with optional "max", "desired" and "timezone"',
+                )
+        return actions
+
+    def image_commands(self, key: str, default: str = None, **values) -> list:
+        commands = self.parsed(key, default=default)
+        for command in commands:
+            if not isinstance(command, str):
+                raise self.error(key, "must be a list of strings")
+            try:
+                command.format(**values)
+            except (KeyError, IndexError, ValueError):
+                raise self.error(
+                    key,
+                    "only "
+                    + ", ".join("{" + name + "}" for name in values)
+                    + " can be interpolated, and other braces must be doubled",
+                )
+        return commands
+
+    def names(self, key: str, default: str = None, wildcards: bool = False) -> list:
+        names = self.parsed(key, default=default)
+        if not all(isinstance(name, str) and name for name in names):
+            raise self.error(key, "must be a list of names")
+        if not wildcards and any("*" in name for name in names):
+            raise self.error(key, "can't use wildcards")
+        if wildcards and any("*" in name[:-1] for name in names):
+            raise self.error(key, "can only use a * at the end of a name")
+        return names
+
+    def path_patterns(self, key: str, default: str = None) -> list:
+        patterns = self.parsed(key, default=default)
+        for pattern in patterns:
+            if (
+                not isinstance(pattern, str)
+                or not pattern.startswith("/")
+                or "*" in pattern[:-1]
+            ):
+                raise self.error(
+                    key, "paths must start with / and can only end with a *"
+                )
+        return patterns
+
+    def redirects(self, key: str, default: str = None) -> dict:
+        redirects = self.parsed(key, expected_type=dict, default=default)
+        for source, target in redirects.items():
+            if not source.startswith("/") or not isinstance(target, str):
+                raise self.error(
+                    key, 'must be like {"/old-path": "/new-path or https://..."}'
+                )
+        return redirects
+
+    def tuning(self, key: str, instance_types: list) -> dict:
+        overrides = self.parsed(key, expected_type=dict, default="{}")
+        try:
+            return profile_for(instance_types, overrides)
+        except ValueError as e:
+            raise self.error(key, str(e))
+
+    def warm_pool(self, key: str, instance_type: str) -> str:
+        warm_pool = self.choice(key, WARM_POOL_STATES, "")
+        if warm_pool == "hibernated":
+            # the root volume is sized for the RAM
+            resources = instance_resources(instance_type)
+            if resources is None:
+                raise self.error(
+                    key, "can't size the root volume for " + instance_type
+                )
+            if resources[1] > HIBERNATION_MAX_MEMORY_MB:
+                raise self.error(
+                    key, "{} has too much memory to hibernate".format(instance_type)
+                )
+        return warm_pool
+
+    def user_data_script(self, key: str) -> str:
+        script = self.text(key)
+        if script and not path.exists(path.join("userdata", script)):
+            raise self.error(key, "no such file in the userdata directory")
+        return script
+
+
+def load_params(config, app_name: str, environment: str) -> AppParams:
+    stanza = _Stanza(config, app_name + "-" + environment)
+
+    aws_region = stanza.text("awsRegion") or os.environ.get(
+        "CDK_DEFAULT_REGION", ""
+    )
+    aws_account = stanza.text("awsAccount") or os.environ.get(
+        "CDK_DEFAULT_ACCOUNT", ""
+    )
+    if not aws_region or not aws_account:
+        raise ParameterError(
+            "[{}] set awsRegion and awsAccount, or run via the cdk CLI so CDK_DEFAULT_REGION and CDK_DEFAULT_ACCOUNT are set".format(
+                stanza.section
+            )
+        )
+
+    name_prefix = app_name + "-" + environment
+    hosted_zone = stanza.text("hostedZone")
+    subdomain = stanza.text("subdomain", "")
+
+    # derive site_url
+    dns_pattern = re.compile(r'^[a-zA-Z]+[a-zA-Z\d-]{,62}')
+    if re.search(dns_pattern, subdomain) != None:
+        site_hostname = subdomain + "." + hosted_zone
+    else:
+        site_hostname = name_prefix + "." + hosted_zone
+
+    db_config = stanza.choice("dbConfig", DB_CONFIGS)
+    db_engine = stanza.choice("dbEngine", DB_ENGINES)
+    db_proxy = stanza.yes_no("dbProxy", "no")
+    if db_proxy and db_config not in ("instance", "cluster"):
+        raise stanza.error("dbProxy", "needs dbConfig=instance or dbConfig=cluster")
+
+    db_cluster_size = (
+        stanza.number("dbClusterSize", minimum=1) if db_config == "cluster" else 0
+    )
+    db_replica_min_max = stanza.optional_min_max("dbReplicaMinMax")
+    if db_replica_min_max != None:
+        if db_config != "cluster":
+            raise stanza.error("dbReplicaMinMax", "needs dbConfig=cluster")
+        # application auto scaling needs an existing replica to copy
+        if db_cluster_size < 2:
+            raise stanza.error(
+                "dbReplicaMinMax", "needs dbClusterSize of 2 or more"
+            )
+        if db_replica_min_max[0] < 1:
+            raise stanza.error("dbReplicaMinMax", "needs at least 1 replica")
+
+    fleet_extra_instance_types = stanza.parsed("fleetExtraInstanceTypes", default="[]")
+    if not all(isinstance(value, str) for value in fleet_extra_instance_types):
+        raise stanza.error("fleetExtraInstanceTypes", "must be a list of strings")
+    fleet_on_demand_percentage = stanza.number(
+        "fleetOnDemandPercentage", 100, maximum=100
+    )
+    fleet_mixed_instances = (
+        len(fleet_extra_instance_types) > 0 or fleet_on_demand_percentage < 100
+    )
+    fleet_warm_pool = stanza.warm_pool(
+        "fleetWarmPool", stanza.text("fleetInstanceType")
+    )
+    if fleet_warm_pool and fleet_mixed_instances:
+        raise stanza.error(
+            "fleetWarmPool",
+            "can't be used with fleetExtraInstanceTypes or Spot instances",
+        )
+
+    publish_events = stanza.yes_no("publishEvents", "no")
+    fleet_refresh_watch = stanza.yes_no("fleetRefreshWatch", "no")
+    if publish_events and fleet_refresh_watch:
+        raise stanza.error("fleetRefreshWatch", "not needed with publishEvents=yes")
+
+    cache_query_strings = stanza.parsed("cacheQueryStrings", default='["*"]')
+    if cache_query_strings != ["*"]:
+        cache_query_strings = stanza.names("cacheQueryStrings")
+    cache_query_strings_deny = stanza.names(
+        "cacheQueryStringsDeny", default="[]"
+    )
+    if cache_query_strings_deny and cache_query_strings != ["*"]:
+        raise stanza.error(
+            "cacheQueryStringsDeny", 'only applies with cacheQueryStrings=["*"]'
+        )
+    # a cache policy can name at most 10 query strings
+    for key, names in (
+        ("cacheQueryStrings", cache_query_strings),
+        ("cacheQueryStringsDeny", cache_query_strings_deny),
+    ):
+        if len(names) > 10:
+            raise stanza.error(key, "can have at most 10 names")
+
+    efs_mount_dir = stanza.text("efsMountDir")
+    # provisioned:N, or the efsProvisionedThroughputMb=N of earlier versions
+    efs_provisioned_throughput_mb = stanza.optional_number("efsProvisionedThroughputMb")
+    efs_throughput_mode = stanza.text("efsThroughputMode", "") or (
+        "bursting" if efs_provisioned_throughput_mb is None else "provisioned"
+    )
+    if efs_throughput_mode.startswith("provisioned:"):
+        try:
+            efs_provisioned_throughput_mb = int(efs_throughput_mode.split(":", 1)[1])
+        except ValueError:
+            efs_provisioned_throughput_mb = 0
+        if efs_provisioned_throughput_mb < 1:
+            raise stanza.error(
+                "efsThroughputMode", "must be like provisioned:N, with N in MiB/s"
+            )
+        efs_throughput_mode = "provisioned"
+    if efs_throughput_mode not in EFS_THROUGHPUT_MODES:
+        raise stanza.error(
+            "efsThroughputMode", "must be bursting, elastic or provisioned:N"
+        )
+    if efs_throughput_mode == "provisioned" and efs_provisioned_throughput_mb is None:
+        raise stanza.error("efsThroughputMode", "must be like provisioned:N")
+    if efs_throughput_mode != "provisioned":
+        efs_provisioned_throughput_mb = None
+    efs_performance_mode = stanza.choice(
+        "efsPerformanceMode", EFS_PERFORMANCE_MODES, "general_purpose"
+    )
+    if efs_performance_mode == "max_io" and efs_throughput_mode == "elastic":
+        raise stanza.error(
+            "efsPerformanceMode", "max_io can't be used with elastic throughput"
+        )
+    efs_access_point_path = stanza.text("efsAccessPointPath", "/")
+    if not efs_access_point_path.startswith("/"):
+        raise stanza.error("efsAccessPointPath", "must start with /")
+    efs_posix_user = stanza.text("efsPosixUser", "")
+    if efs_posix_user:
+        if not re.match(r"^\d+:\d+$", efs_posix_user):
+            raise stanza.error("efsPosixUser", "must be like uid:gid, eg 48:48")
+        efs_posix_user = [int(part) for part in efs_posix_user.split(":")]
+    else:
+        efs_posix_user = []
+
+    fleet_local_sync = stanza.yes_no("fleetLocalSync", "no")
+    fleet_app_dir = efs_mount_dir
+    if fleet_local_sync:
+        fleet_app_dir = stanza.text("fleetAppDir", "/srv/app").rstrip("/")
+        if not fleet_app_dir.startswith("/") or fleet_app_dir == efs_mount_dir:
+            raise stanza.error(
+                "fleetAppDir", "must be an absolute path other than efsMountDir"
+            )
+    # rsync patterns, quoted in the app-sync script
+    fleet_sync_exclude = stanza.parsed("fleetSyncExclude", default="[]")
+    if not all(
+        isinstance(pattern, str) and pattern and "'" not in pattern
+        for pattern in fleet_sync_exclude
+    ):
+        raise stanza.error("fleetSyncExclude", "must be a list of rsync patterns")
+
+    return AppParams(
+        app_name=app_name,
+        environment=environment,
+        aws_region=aws_region,
+        aws_account=aws_account,
+        hosted_zone=hosted_zone,
+        subdomain=subdomain,
+        site_hostname=site_hostname,
+        vpc_cidr_block=stanza.text("vpcCidrBlock"),
+        nat_gateway_count=stanza.number("natGatewayCount"),
+        admin_ips=stanza.csv("adminIps"),
+        allowed_ips=stanza.csv("allowedIps"),
+        db_config=db_config,
+        db_snapshot_id=stanza.text("dbSnapshot", ""),
+        db_engine=db_engine,
+        db_major_version=stanza.text("dbMajorVersion"),
+        db_full_version=stanza.text("dbFullVersion"),
+        db_instance_type=stanza.text("dbInstanceType"),
+        db_cluster_size=db_cluster_size,
+        db_replica_min_max=db_replica_min_max,
+        db_replica_cpu_target=stanza.number("dbReplicaCpuTarget", 70, minimum=1),
+        db_replica_connections_target=stanza.optional_number(
+            "dbReplicaConnectionsTarget"
+        ),
+        db_secret_name=stanza.text("dbSecretName", ""),
+        db_port=5432 if db_engine == "postgres" else 3306,
+        db_proxy=db_proxy,
+        prevent_deletion=stanza.yes_no("preventDeletion"),
+        cache_engine=stanza.choice("cacheEngine", CACHE_ENGINES, ""),
+        cache_node_type=stanza.text("cacheNodeType", "cache.t4g.micro"),
+        cache_nodes=stanza.number("cacheNodes", 1, minimum=1),
+        cache_port=stanza.number("cachePort", 6379, minimum=1),
+        ami_parameter=stanza.text("amiParameter"),
+        image_build_commands=stanza.image_commands(
+            "imageBuildCommands",
+            "[]",
+            efs_mount_dir="",
+            site_hostname="",
+        ),
+        image_rebuild_schedule=stanza.text("imageRebuildSchedule", ""),
+        efs_mount_dir=efs_mount_dir,
+        efs_throughput_mode=efs_throughput_mode,
+        efs_provisioned_throughput_mb=efs_provisioned_throughput_mb,
+        efs_performance_mode=efs_performance_mode,
+        efs_access_points=stanza.yes_no("efsAccessPoints", "no"),
+        efs_access_point_path=efs_access_point_path,
+        efs_posix_user=efs_posix_user,
+        target_port=stanza.number("targetPort", minimum=1),
+        admin_user_data=stanza.parsed("adminUserData"),
+        fleet_user_data=stanza.parsed("fleetUserData"),
+        admin_user_data_script=stanza.user_data_script("adminUserDataScript"),
+        fleet_user_data_script=stanza.user_data_script("fleetUserDataScript"),
+        min_max_admin_instances=stanza.min_max("minMaxAdminInstances"),
+        min_max_fleet_instances=stanza.min_max("minMaxFleetInstances"),
+        admin_instance_type=stanza.text("adminInstanceType"),
+        fleet_instance_type=stanza.text("fleetInstanceType"),
+        fleet_extra_instance_types=fleet_extra_instance_types,
+        fleet_on_demand_base=stanza.number("fleetOnDemandBase", 0),
+        fleet_on_demand_percentage=fleet_on_demand_percentage,
+        fleet_mixed_instances=fleet_mixed_instances,
+        admin_tuning=stanza.tuning(
+            "adminTuning", [stanza.text("adminInstanceType")]
+        ),
+        # sized for the smallest type the fleet can launch
+        fleet_tuning=stanza.tuning(
+            "fleetTuning",
+            [stanza.text("fleetInstanceType")] + fleet_extra_instance_types,
+        ),
+        fleet_opcache_preload=stanza.names("fleetOpcachePreload", default="[]"),
+        fleet_local_sync=fleet_local_sync,
+        fleet_app_dir=fleet_app_dir,
+        fleet_sync_user=stanza.text("fleetSyncUser", "root"),
+        fleet_sync_exclude=fleet_sync_exclude,
+        admin_publish_watch=[
+            name.lstrip("/")
+            for name in stanza.names("adminPublishWatch", default="[]")
+        ],
+        publish_events=publish_events,
+        fleet_refresh_watch=fleet_refresh_watch,
+        code_version_parameter="/" + name_prefix + "/code-version",
+        admin_build_time=stanza.number("adminBuildTime"),
+        fleet_build_time=stanza.number("fleetBuildTime"),
+        admin_warm_pool=stanza.warm_pool(
+            "adminWarmPool", stanza.text("adminInstanceType")
+        ),
+        admin_warm_pool_size=stanza.number("adminWarmPoolSize", 1),
+        fleet_warm_pool=fleet_warm_pool,
+        fleet_warm_pool_size=stanza.number("fleetWarmPoolSize", 1),
+        fleet_requests_per_target=stanza.optional_number("fleetRequestsPerTarget"),
+        fleet_cpu_target=stanza.optional_number("fleetCpuTarget"),
+        fleet_scheduled_scaling=stanza.scheduled_actions("fleetScheduledScaling", "[]"),
+        managed_waf_rules=stanza.parsed("managedWafRules"),
+        uncached_paths=stanza.parsed("uncachedPaths"),
+        static_paths=stanza.parsed("staticPaths", default="[]"),
+        static_ttl_days=stanza.number("staticTtlDays", 30, minimum=1),
+        static_query_strings=stanza.parsed("staticQueryStrings", default='["ver"]'),
+        cache_query_strings=cache_query_strings,
+        cache_query_strings_deny=cache_query_strings_deny,
+        stripped_query_strings=stanza.names(
+            "strippedQueryStrings",
+            default='["utm_*","fbclid","gclid","dclid","msclkid","mc_cid","mc_eid","_ga"]',
+            wildcards=True,
+        ),
+        admin_paths=stanza.path_patterns("adminPaths", default="[]"),
+        edge_redirects=stanza.redirects("edgeRedirects", default="{}"),
+        stripped_headers=[
+            name.lower() for name in stanza.names("strippedHeaders", default="[]")
+        ],
+        trailing_slash=stanza.choice("trailingSlash", TRAILING_SLASHES, ""),
+        lowercase_host=stanza.yes_no("lowercaseHost", "yes"),
+        media_bucket=stanza.yes_no("mediaBucket", "no"),
+        media_path=stanza.text("mediaPath", "/wp-content/uploads/*"),
+        # in the cdn stack, but the compute stack needs the name, so it can't
+        # be generated
+        media_bucket_name=(name_prefix + "-media-" + aws_account).lower(),
+        forwarded_cookies=stanza.parsed("forwardedCookies"),
+        cdn_invalidation=stanza.yes_no("cdnInvalidation", "no"),
+        # SQS batching windows are 1 to 300 seconds
+        invalidation_window=stanza.number(
+            "invalidationWindow", 60, minimum=1, maximum=300
+        ),
+        invalidation_max_paths=stanza.number(
+            "invalidationMaxPaths", 100, minimum=1, maximum=3000
+        ),
+        # in the cdn stack, but the compute stack needs the name to send to it
+        invalidation_queue_name=name_prefix + "-invalidations",
+        # "auto" puts the origin shield in the same region as the ALB
+        origin_shield_region=(
+            aws_region
+            if stanza.text("originShieldRegion", "") == "auto"
+            else stanza.text("originShieldRegion", "")
+        ),
+        # the upper limits are CloudFront's defaults, they can be raised
+        # with a service quota increase
+        origin_read_timeout=stanza.number(
+            "originReadTimeout", 30, minimum=1, maximum=180
+        ),
+        origin_keepalive_timeout=stanza.number(
+            "originKeepaliveTimeout", 60, minimum=1, maximum=180
+        ),
+        origin_connection_attempts=stanza.number(
+            "originConnectionAttempts", 3, minimum=1, maximum=3
+        ),
+        origin_connection_timeout=stanza.number(
+            "originConnectionTimeout", 10, minimum=1, maximum=10
+        ),
+        name_prefix=name_prefix,
+        resource_prefix=app_name.capitalize() + environment.capitalize(),
+        network_stack_name=name_prefix + "-network-stack",
+        database_stack_name=name_prefix + "-database-stack",
+        image_stack_name=name_prefix + "-image-stack",
+        compute_stack_name=name_prefix + "-compute-stack",
+        cdn_stack_name=name_prefix + "-cdn-stack",
+        db_secret_param="/" + app_name + "/" + environment + "/DatabaseSecret",
+        db_host_param="/" + app_name + "/" + environment + "/DatabaseHost",
+        db_read_host_param="/" + app_name + "/" + environment + "/DatabaseReadHost",
+        image_ami_param="/" + app_name + "/" + environment + "/ami-id",
+        alb_hostname_param="/" + app_name + "/" + environment + "/alb-hostname",
+        cloudfront_secret_param="/"
+        + app_name
+        + "/"
+        + environment
+        + "/cloudfront-secret",
+    )
@@ -0,0 +1,230 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Resolves everything app.py needs from AWS before synth through shared boto3
+# clients, running the lookups concurrently on a thread pool and recording
+# how long each one took. Pass `clients` (eg clients with a botocore Stubber
+# activated, see stubbed_clients below) to run without network access.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+from app_config.lookup_cache import LookupCache
+
+CLOUDFRONT_PREFIX_LIST = "com.amazonaws.global.cloudfront.origin-facing"
+
+client_config = Config(
+    retries={"max_attempts": 5, "mode": "standard"}, max_pool_connections=10
+)
+
+
+def hosted_zone_id(route53_client, zone_name: str) -> str:
+    response = route53_client.list_hosted_zones_by_name(
+        DNSName=zone_name, MaxItems="1"
+    )
+    zones = response["HostedZones"]
+    if len(zones) == 0 or zones[0]["Name"].rstrip(".") != zone_name.rstrip("."):
+        raise ValueError("Hosted zone {} was not found".format(zone_name))
+    return zones[0]["Id"].replace("/hostedzone/", "")
+
+
+def cloudfront_prefix(ec2_client) -> str:
+    response = ec2_client.describe_managed_prefix_lists(
+        Filters=[{"Name": "prefix-list-name", "Values": [CLOUDFRONT_PREFIX_LIST]}]
+    )
+    return response["PrefixLists"][0]["PrefixListId"]
+
+
+def ssm_parameter(ssm_client, name: str):
+    try:
+        response = ssm_client.get_parameter(Name=name)
+    except ssm_client.exceptions.ParameterNotFound:
+        return None
+    except ClientError as e:
+        # eg access denied, skip whatever needs it as if it wasn't there
+        print(
+            "Couldn't get parameter {} in {}: {}".format(
+                name, ssm_client.meta.region_name, e
+            )
+        )
+        return None
+    return response["Parameter"]["Value"]
+
+
+class LookupResolver:
+    def __init__(
+        self,
+        session: boto3.session.Session = None,
+        cache: LookupCache = None,
+        clients: dict = None,
+        max_workers: int = 8,
+    ) -> None:
+        self.session = session or boto3.session.Session()
+        self.cache = cache
+        self.max_workers = max_workers
+        # (service, region) -> client, shared by every lookup
+        self.clients = dict(clients or {})
+        self.timings = {}
+
+    def client(self, service: str, region: str):
+        if (service, region) not in self.clients:
+            self.clients[(service, region)] = self.session.client(
+                service_name=service, region_name=region, config=client_config
+            )
+        return self.clients[(service, region)]
+
+    def app_lookups(self, params) -> dict:
+        """The lookups app.py needs for one app/env, keyed by result name.
+
+        Each lookup is (account, region, query, (service, client_region), fetch)
+        where fetch is called with the shared client for that service/region.
+        """
+        return {
+            # route53 is a global service, so hosted zones aren't keyed by region
+            "hosted_zone_id": (
+                params.aws_account,
+                "global",
+                "hosted-zone:" + params.hosted_zone,
+                ("route53", "us-east-1"),
+                lambda client: hosted_zone_id(client, params.hosted_zone),
+            ),
+            "cloudfront_prefix": (
+                params.aws_account,
+                params.aws_region,
+                "prefix-list:" + CLOUDFRONT_PREFIX_LIST,
+                ("ec2", params.aws_region),
+                cloudfront_prefix,
+            ),
+            "alb_hostname": (
+                params.aws_account,
+                "us-east-1",
+                "ssm-parameter:" + params.alb_hostname_param,
+                ("ssm", "us-east-1"),
+                lambda client: ssm_parameter(client, params.alb_hostname_param),
+            ),
+        }
+
+    def resolve(self, lookups: dict) -> dict:
+        """Run lookups (as returned by app_lookups) and return {name: value}.
+
+        Cache hits are answered inline; misses run concurrently. Timings for
+        every lookup (cache hits included) are recorded in self.timings.
+        """
+        results = {}
+        pending = {}
+        for name, (account, region, query, client_key, fetch) in lookups.items():
+            start = time.perf_counter()
+            hit, value = False, None
+            if self.cache:
+                hit, value = self.cache.peek(account, region, query)
+            if hit:
+                results[name] = value
+                self.timings[name] = (time.perf_counter() - start, "cache")
+            else:
+                # boto3 sessions aren't thread safe, so clients are created
+                # here rather than in the worker threads
+                pending[name] = (
+                    account,
+                    region,
+                    query,
+                    self.client(*client_key),
+                    fetch,
+                )
+
+        if not pending:
+            return results
+
+        def timed(client, fetch):
+            start = time.perf_counter()
+            value = fetch(client)
+            return value, time.perf_counter() - start
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(pending))
+        ) as executor:
+            futures = {
+                name: executor.submit(timed, lookup[3], lookup[4])
+                for name, lookup in pending.items()
+            }
+            for name, future in futures.items():
+                value, elapsed = future.result()
+                results[name] = value
+                self.timings[name] = (elapsed, "aws")
+                account, region, query, _, _ = pending[name]
+                if self.cache:
+                    self.cache.put(account, region, query, value)
+
+        return results
+
+    def report(self) -> str:
+        return "\n".join(
+            "{:<20} {:>8.1f} ms ({})".format(name, elapsed * 1000, source)
+            for name, (elapsed, source) in self.timings.items()
+        )
+
+
+def stubbed_clients(
+    session: boto3.session.Session,
+    region: str,
+    hosted_zone: str,
+    hosted_zone_id: str = "Z0000000000000000000",
+    prefix_list_id: str = "pl-3b927c52",
+    alb_hostname_param: str = None,
+    alb_hostname: str = None,
+) -> dict:
+    """Clients for LookupResolver(clients=...) that answer from canned responses."""
+    route53_client = session.client("route53", region_name="us-east-1")
+    ec2_client = session.client("ec2", region_name=region)
+    ssm_client = session.client("ssm", region_name="us-east-1")
+
+    route53_stub = Stubber(route53_client)
+    route53_stub.add_response(
+        "list_hosted_zones_by_name",
+        {
+            "HostedZones": [
+                {
+                    "Id": "/hostedzone/" + hosted_zone_id,
+                    "Name": hosted_zone + ".",
+                    "CallerReference": "stub",
+                }
+            ],
+            "IsTruncated": False,
+            "MaxItems": "1",
+        },
+    )
+    ec2_stub = Stubber(ec2_client)
+    ec2_stub.add_response(
+        "describe_managed_prefix_lists",
+        {
+            "PrefixLists": [
+                {
+                    "PrefixListId": prefix_list_id,
+                    "PrefixListName": CLOUDFRONT_PREFIX_LIST,
+                }
+            ]
+        },
+    )
+    ssm_stub = Stubber(ssm_client)
+    if alb_hostname:
+        ssm_stub.add_response(
+            "get_parameter",
+            {"Parameter": {"Name": alb_hostname_param, "Value": alb_hostname}},
+        )
+    else:
+        ssm_stub.add_client_error(
+            "get_parameter", service_error_code="ParameterNotFound"
+        )
+
+    for stub in (route53_stub, ec2_stub, ssm_stub):
+        stub.activate()
+
+    return {
+        ("route53", "us-east-1"): route53_client,
+        ("ec2", region): ec2_client,
+        ("ssm", "us-east-1"): ssm_client,
+    }
@@ -0,0 +1,16 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import time
+from contextlib import contextmanager
+
+
+@contextmanager
+def stopwatch(timings: dict, name: str):
+    """Record the wall time of the with block in timings[name], if timings is a dict."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = time.perf_counter() - start
@@ -0,0 +1,136 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Sizes Apache, PHP-FPM and OPcache for an instance type. The values are
+# interpolated into user data, eg {php_max_children}, so a t4g.nano and an
+# m7g.xlarge don't run the same worker counts. Like the rest of app_config
+# this needs no AWS calls: the vCPUs and memory come from the instance type
+# naming scheme, and can be given in adminTuning/fleetTuning for types it
+# doesn't cover.
+
+import re
+
+# memory per vCPU, in MiB, for the families where it is fixed
+MEMORY_PER_VCPU = {"c": 2048, "m": 4096, "r": 8192, "x": 16384}
+# vCPUs by size, Nxlarge has 4N
+SIZE_VCPUS = {"medium": 1, "large": 2, "xlarge": 4}
+# burstable types don't follow the pattern, (vCPUs, MiB) by size
+BURSTABLE_SIZES = {
+    "nano": (2, 512),
+    "micro": (2, 1024),
+    "small": (2, 2048),
+    "medium": (2, 4096),
+    "large": (2, 8192),
+    "xlarge": (4, 16384),
+    "2xlarge": (8, 32768),
+}
+
+# assumed for types the naming scheme doesn't cover, eg a1, .metal or im4gn,
+# small enough not to run out of memory on any of them
+DEFAULT_RESOURCES = (1, 1024)
+
+# memory for each PHP-FPM child, about right for WordPress with plugins
+PHP_CHILD_MB = 64
+APACHE_THREADS_PER_CHILD = 25
+
+PROFILE_KEYS = (
+    "vcpus",
+    "memory_mb",
+    "apache_server_limit",
+    "apache_max_request_workers",
+    "apache_threads_per_child",
+    "php_pm",
+    "php_max_children",
+    "php_start_servers",
+    "php_min_spare_servers",
+    "php_max_spare_servers",
+    "php_max_requests",
+    "opcache_memory_mb",
+    "opcache_interned_strings_mb",
+    "opcache_max_files",
+    "page_cache_mb",
+)
+
+
+def instance_resources(instance_type: str) -> tuple:
+    """(vCPUs, memory in MiB) for an instance type, or None if unknown."""
+    match = re.match(r"^([a-z]+?)(\d+)[a-z-]*\.(\w+)$", instance_type)
+    if not match:
+        return None
+    family, generation, size = match.groups()
+    if family == "t":
+        resources = BURSTABLE_SIZES.get(size)
+        # the previous generation has 1 vCPU up to small
+        if resources and generation == "2" and size in ("nano", "micro", "small"):
+            resources = (1, resources[1])
+        return resources
+    if family not in MEMORY_PER_VCPU:
+        return None
+    xlarge = re.match(r"^(\d+)xlarge$", size)
+    vcpus = int(xlarge.group(1)) * 4 if xlarge else SIZE_VCPUS.get(size)
+    if vcpus is None:
+        return None
+    return (vcpus, vcpus * MEMORY_PER_VCPU[family])
+
+
+def tuning_profile(vcpus: int, memory_mb: int) -> dict:
+    opcache_memory_mb = min(max(memory_mb // 16, 64), 256)
+    # the tmpfs for Apache's page cache
+    page_cache_mb = min(max(memory_mb // 8, 32), 1024)
+    # leave room for the OS, the EFS client and Apache itself
+    reserved_mb = max(256, memory_mb // 5)
+    php_max_children = max(
+        2,
+        min(
+            (memory_mb - reserved_mb - opcache_memory_mb - page_cache_mb)
+            // PHP_CHILD_MB,
+            # more than this and the children just queue for the CPU
+            vcpus * 8,
+        ),
+    )
+    apache_server_limit = max(2, min(vcpus * 2, memory_mb // 256))
+    return {
+        "vcpus": vcpus,
+        "memory_mb": memory_mb,
+        "apache_server_limit": apache_server_limit,
+        "apache_max_request_workers": apache_server_limit * APACHE_THREADS_PER_CHILD,
+        "apache_threads_per_child": APACHE_THREADS_PER_CHILD,
+        # ondemand doesn't keep idle children around on the smallest instances
+        "php_pm": "ondemand" if memory_mb < 1024 else "dynamic",
+        "php_max_children": php_max_children,
+        "php_start_servers": max(1, php_max_children // 4),
+        "php_min_spare_servers": max(1, php_max_children // 4),
+        "php_max_spare_servers": max(2, php_max_children // 2),
+        "php_max_requests": 500,
+        "opcache_memory_mb": opcache_memory_mb,
+        "opcache_interned_strings_mb": 16 if opcache_memory_mb >= 128 else 8,
+        "opcache_max_files": 20000 if opcache_memory_mb >= 128 else 10000,
+        "page_cache_mb": page_cache_mb,
+    }
+
+
+def profile_for(instance_types: list, overrides: dict) -> dict:
+    """The profile for the smallest of instance_types, with overrides.
+
+    Unknown instance types are sized as DEFAULT_RESOURCES, unless the
+    overrides give the vcpus and memory_mb. Raises ValueError for an
+    override that isn't a profile key.
+    """
+    unknown = [key for key in overrides if key not in PROFILE_KEYS]
+    if unknown:
+        raise ValueError(
+            "can't set {}, only {}".format(", ".join(unknown), ", ".join(PROFILE_KEYS))
+        )
+    if "vcpus" in overrides and "memory_mb" in overrides:
+        resources = [(overrides["vcpus"], overrides["memory_mb"])]
+    else:
+        resources = [
+            instance_resources(instance_type) or DEFAULT_RESOURCES
+            for instance_type in instance_types
+        ]
+    profile = tuning_profile(
+        min(vcpus for vcpus, _ in resources),
+        min(memory_mb for _, memory_mb in resources),
+    )
+    profile.update(overrides)
+    return profile
@@ -11,6 +11,11 @@ from aws_cdk import (
     aws_certificatemanager as acm,
     aws_ssm as ssm,
     aws_secretsmanager as secretsmanager,
+    aws_iam as iam,
+    aws_lambda as aws_lambda,
+    aws_lambda_event_sources as lambda_event_sources,
+    aws_sqs as sqs,
+    aws_cloudwatch as cloudwatch,
 )
 
 import aws_cdk as cdk
@@ -20,6 +25,9 @@ from cdk_nag import NagSuppressions, NagPackSuppression
 
 import jsii
 
+from app_config.edge_function import viewer_request_code
+from app_config.parameters import AppParams
+
 
 @jsii.implements(wafv2.CfnRuleGroup.IPSetReferenceStatementProperty)
 class IPSetReferenceStatement:
@@ -32,28 +40,66 @@ class IPSetReferenceStatement:
         self._arn = value
 
 
+@jsii.implements(cloudfront.IOrigin)
+class S3OacOrigin:
+    """An S3 bucket origin that CloudFront signs requests to with an origin
+    access control. CDK's S3Origin can only use an origin access identity,
+    and an HttpOrigin has a custom origin config S3 won't accept."""
+
+    def __init__(
+        self,
+        bucket: s3.IBucket,
+        origin_access_control_id: str,
+        origin_shield_region: str = None,
+    ) -> None:
+        self.bucket = bucket
+        self.origin_access_control_id = origin_access_control_id
+        self.origin_shield_region = origin_shield_region
+
+    def bind(
+        self, scope: Construct, *, origin_id: str
+    ) -> cloudfront.OriginBindConfig:
+        origin_shield = None
+        if self.origin_shield_region:
+            origin_shield = cloudfront.CfnDistribution.OriginShieldProperty(
+                enabled=True, origin_shield_region=self.origin_shield_region
+            )
+        return cloudfront.OriginBindConfig(
+            origin_property=cloudfront.CfnDistribution.OriginProperty(
+                id=origin_id,
+                domain_name=self.bucket.bucket_regional_domain_name,
+                # an empty identity, as access is through the OAC instead
+                s3_origin_config=cloudfront.CfnDistribution.S3OriginConfigProperty(
+                    origin_access_identity=""
+                ),
+                origin_access_control_id=self.origin_access_control_id,
+                origin_shield=origin_shield,
+            )
+        )
+
+
 class CdnStack(Stack):
     def __init__(
-        self, scope: Construct, construct_id: str, params: map, **kwargs
+        self, scope: Construct, construct_id: str, params: AppParams, **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         hosted_zone = route53.HostedZone.from_hosted_zone_attributes(
             self,
             "MyZone",
-            zone_name=params["hosted_zone"],
-            hosted_zone_id=params["hosted_zone_id"],
+            zone_name=params.hosted_zone,
+            hosted_zone_id=params.hosted_zone_id,
         )
 
         cloudfront_web_cert = acm.Certificate(
             self,
             "WebCertificate",
-            domain_name=params["site_hostname"],
+            domain_name=params.site_hostname,
             validation=acm.CertificateValidation.from_dns(hosted_zone=hosted_zone),
         )
 
         waf_rules = []
-        managed_rules = params["managed_waf_rules"]
+        managed_rules = params.managed_waf_rules
         rule_count = 1
         for rule in managed_rules:
             waf_rules.append(
@@ -79,13 +125,13 @@ class CdnStack(Stack):
         # with AWS managed rules rely on them to block as they see fit and allow the rest
         waf_default_action = wafv2.CfnWebACL.DefaultActionProperty(allow={})
 
-        if params["allowed_ips"][0] != "*":
+        if params.allowed_ips[0] != "*":
             # with an IP allow list we need to block any requests that don't match
             waf_default_action = wafv2.CfnWebACL.DefaultActionProperty(block={})
             permitted_ips_v4 = wafv2.CfnIPSet(
                 self,
                 "IPSetv4",
-                addresses=params["allowed_ips"],
+                addresses=params.allowed_ips,
                 ip_address_version="IPV4",
                 scope="CLOUDFRONT",
             )
@@ -120,11 +166,11 @@ class CdnStack(Stack):
             rules=waf_rules,
         )
 
-        if params["forwarded_cookies"][0] == "*":
+        if params.forwarded_cookies[0] == "*":
             cookie_behaviour = cloudfront.OriginRequestCookieBehavior.all()
         else:
             cookie_behaviour = cloudfront.OriginRequestCookieBehavior.allow_list(
-                *params["forwarded_cookies"]
+                *params.forwarded_cookies
             )
 
         cf_origin_req_policy_headers = cloudfront.OriginRequestPolicy(
@@ -151,19 +197,63 @@ class CdnStack(Stack):
             query_string_behavior=cloudfront.OriginRequestQueryStringBehavior.all(),
         )
 
+        # the origin still gets every query string, these only decide which
+        # ones make a response different
+        if not params.cache_query_strings:
+            cache_query_strings = cloudfront.CacheQueryStringBehavior.none()
+        elif params.cache_query_strings != ["*"]:
+            cache_query_strings = cloudfront.CacheQueryStringBehavior.allow_list(
+                *params.cache_query_strings
+            )
+        elif params.cache_query_strings_deny:
+            cache_query_strings = cloudfront.CacheQueryStringBehavior.deny_list(
+                *params.cache_query_strings_deny
+            )
+        else:
+            cache_query_strings = cloudfront.CacheQueryStringBehavior.all()
+
         cf_cache_policy = cloudfront.CachePolicy(
             self,
             "WpCachePolicy",
-            cache_policy_name=params["app_name"]
-            + "-"
-            + params["environment"]
-            + "-cache-policy",
-            query_string_behavior=cloudfront.CacheQueryStringBehavior.all(),
+            cache_policy_name=params.name_prefix + "-cache-policy",
+            query_string_behavior=cache_query_strings,
             min_ttl=cdk.Duration.seconds(1),
             max_ttl=cdk.Duration.seconds(31536000),
             default_ttl=cdk.Duration.seconds(86400),
             enable_accept_encoding_gzip=True,
-            enable_accept_encoding_brotli=False,
+            enable_accept_encoding_brotli=True,
+        )
+
+        # static assets don't vary by cookie or header, so they get a minimal
+        # cache key and can be cached for much longer
+        static_query_strings = cloudfront.CacheQueryStringBehavior.none()
+        if params.static_query_strings:
+            static_query_strings = cloudfront.CacheQueryStringBehavior.allow_list(
+                *params.static_query_strings
+            )
+        static_cache_policy = cloudfront.CachePolicy(
+            self,
+            "StaticCachePolicy",
+            cache_policy_name=params.name_prefix + "-static-cache-policy",
+            query_string_behavior=static_query_strings,
+            header_behavior=cloudfront.CacheHeaderBehavior.none(),
+            cookie_behavior=cloudfront.CacheCookieBehavior.none(),
+            # the origin's Cache-Control still wins, eg no-cache from a script
+            min_ttl=cdk.Duration.seconds(0),
+            max_ttl=cdk.Duration.days(365),
+            default_ttl=cdk.Duration.days(params.static_ttl_days),
+            enable_accept_encoding_gzip=True,
+            enable_accept_encoding_brotli=True,
+        )
+
+        # the ALB certificate is for the site hostname, so the Host header is
+        # still needed for CloudFront to validate it
+        static_origin_req_policy = cloudfront.OriginRequestPolicy(
+            self,
+            "OriginReqPolicyStatic",
+            header_behavior=cloudfront.OriginRequestHeaderBehavior.allow_list("Host"),
+            cookie_behavior=cloudfront.OriginRequestCookieBehavior.none(),
+            query_string_behavior=cloudfront.OriginRequestQueryStringBehavior.none(),
         )
 
         cf_dist_bucket = s3.Bucket(
@@ -176,13 +266,13 @@ class CdnStack(Stack):
         )
 
         alb_hostname = ssm.StringParameter.value_from_lookup(
-            self, parameter_name=params["alb_hostname_param"]
+            self, parameter_name=params.alb_hostname_param
         )
 
         cf_secret_arn = ssm.StringParameter.from_string_parameter_name(
             self,
             "SecretNameParam",
-            string_parameter_name=params["cloudfront_secret_param"],
+            string_parameter_name=params.cloudfront_secret_param,
         )
 
         cloudfront_secret = secretsmanager.Secret.from_secret_attributes(
@@ -205,25 +295,20 @@ class CdnStack(Stack):
             origin_ssl_protocols=[cloudfront.OriginSslPolicy.TLS_V1_2],
             protocol_policy=cloudfront.OriginProtocolPolicy.HTTPS_ONLY,
             custom_headers={"cloudfront": cloudfront_secret_value},
-            keepalive_timeout=cdk.Duration.seconds(60),
+            keepalive_timeout=cdk.Duration.seconds(params.origin_keepalive_timeout),
+            read_timeout=cdk.Duration.seconds(params.origin_read_timeout),
+            connection_attempts=params.origin_connection_attempts,
+            connection_timeout=cdk.Duration.seconds(params.origin_connection_timeout),
+            # one more caching layer, so misses at the edge don't all reach the ALB
+            origin_shield_region=params.origin_shield_region or None,
         )
 
+        # sets true-client-ip, and normalizes, redirects or blocks requests
+        # before they reach the cache, see cloudfront_function/viewer_request.js
         ip_function = cloudfront.Function(
             self,
             "IpFunction",
-            code=cloudfront.FunctionCode.from_inline(
-                code="""
-function handler(event) {
-    var request = event.request;
-    var clientIP = event.viewer.ip;
-
-    //Add the true-client-ip header to the incoming request
-    request.headers['true-client-ip'] = {value: clientIP};
-
-    return request;
-}
-        """
-            ),
+            code=cloudfront.FunctionCode.from_inline(viewer_request_code(params)),
         )
 
         cf_dist = cloudfront.Distribution(
@@ -232,7 +317,7 @@ function handler(event) {
             log_bucket=cf_dist_bucket,
             web_acl_id=waf.attr_arn,
             certificate=cloudfront_web_cert,
-            domain_names=[params["site_hostname"]],
+            domain_names=[params.site_hostname],
             minimum_protocol_version=cloudfront.SecurityPolicyProtocol.TLS_V1_2_2021,
             enable_logging=True,
             default_behavior=cloudfront.BehaviorOptions(
@@ -253,13 +338,15 @@ function handler(event) {
             default_root_object="",
         )
 
-        for path in params["uncached_paths"]:
+        # behaviors match in the order they are added, so the uncached paths
+        # come first, eg /wp-admin/* takes precedence over *.css
+        for path in params.uncached_paths:
             cf_dist.add_behavior(
                 path_pattern=path,
                 origin=request_origin,
                 compress=True,
                 allowed_methods=cloudfront.AllowedMethods.ALLOW_ALL,
-                cache_policy=cf_cache_policy,
+                cache_policy=cloudfront.CachePolicy.CACHING_DISABLED,
                 cached_methods=cloudfront.CachedMethods.CACHE_GET_HEAD_OPTIONS,
                 origin_request_policy=cf_origin_req_policy_headers_nocache,
                 viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
@@ -271,6 +358,191 @@ function handler(event) {
                 ],
             )
 
+        if params.media_bucket:
+            media_bucket = s3.Bucket(
+                self,
+                "MediaBucket",
+                bucket_name=params.media_bucket_name,
+                block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+                encryption=s3.BucketEncryption.S3_MANAGED,
+                enforce_ssl=True,
+                removal_policy=cdk.RemovalPolicy.RETAIN,
+            )
+
+            origin_access_control = cloudfront.CfnOriginAccessControl(
+                self,
+                "MediaOriginAccessControl",
+                origin_access_control_config=cloudfront.CfnOriginAccessControl.OriginAccessControlConfigProperty(
+                    name=params.name_prefix + "-media-oac",
+                    origin_access_control_origin_type="s3",
+                    signing_behavior="always",
+                    signing_protocol="sigv4",
+                ),
+            )
+
+            # no origin request policy, S3 mustn't get the viewer's Host header
+            cf_dist.add_behavior(
+                path_pattern=params.media_path,
+                # the bucket is in this stack's region, us-east-1, wherever the
+                # ALB's origin shield is
+                origin=S3OacOrigin(
+                    media_bucket,
+                    origin_access_control.attr_id,
+                    origin_shield_region=(
+                        self.region if params.origin_shield_region else None
+                    ),
+                ),
+                compress=True,
+                allowed_methods=cloudfront.AllowedMethods.ALLOW_GET_HEAD,
+                cached_methods=cloudfront.CachedMethods.CACHE_GET_HEAD,
+                cache_policy=static_cache_policy,
+                viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+            )
+
+            media_bucket.add_to_resource_policy(
+                iam.PolicyStatement(
+                    actions=["s3:GetObject"],
+                    effect=iam.Effect.ALLOW,
+                    principals=[iam.ServicePrincipal("cloudfront.amazonaws.com")],
+                    resources=[media_bucket.arn_for_objects("*")],
+                    conditions={
+                        "StringEquals": {
+                            "AWS:SourceArn": "arn:aws:cloudfront::"
+                            + self.account
+                            + ":distribution/"
+                            + cf_dist.distribution_id
+                        }
+                    },
+                )
+            )
+
+            NagSuppressions.add_resource_suppressions(
+                media_bucket,
+                suppressions=[
+                    NagPackSuppression(
+                        id="AwsSolutions-S1",
+                        reason="Reads are recorded in the CloudFront access logs",
+                    ),
+                ],
+            )
+
+        for path in params.static_paths:
+            cf_dist.add_behavior(
+                path_pattern=path,
+                origin=request_origin,
+                compress=True,
+                allowed_methods=cloudfront.AllowedMethods.ALLOW_GET_HEAD,
+                cached_methods=cloudfront.CachedMethods.CACHE_GET_HEAD,
+                cache_policy=static_cache_policy,
+                origin_request_policy=static_origin_req_policy,
+                viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+            )
+
+        if params.cdn_invalidation:
+            invalidation_dlq = sqs.Queue(
+                self,
+                "InvalidationDeadLetterQueue",
+                encryption=sqs.QueueEncryption.KMS_MANAGED,
+                enforce_ssl=True,
+                retention_period=cdk.Duration.days(14),
+            )
+            invalidation_queue = sqs.Queue(
+                self,
+                "InvalidationQueue",
+                queue_name=params.invalidation_queue_name,
+                encryption=sqs.QueueEncryption.KMS_MANAGED,
+                enforce_ssl=True,
+                # the messages are in flight for the batching window as well
+                # as the function's run, so a failed batch is retried soon
+                visibility_timeout=cdk.Duration.seconds(
+                    300 + params.invalidation_window
+                ),
+                dead_letter_queue=sqs.DeadLetterQueue(
+                    max_receive_count=10, queue=invalidation_dlq
+                ),
+            )
+
+            invalidation_lambda = aws_lambda.Function(
+                self,
+                "InvalidationHandler",
+                runtime=aws_lambda.Runtime.PYTHON_3_9,
+                architecture=aws_lambda.Architecture.ARM_64,
+                handler="invalidate.handler",
+                code=aws_lambda.Code.from_asset("cdn_invalidation"),
+                # no reserved concurrency, the event source polls with several
+                # pollers and would be throttled. the batching window already
+                # coalesces the paths, and CloudFront allows invalidations to
+                # run concurrently. the handler waits out too many
+                # invalidations in progress for up to the timeout
+                timeout=cdk.Duration.minutes(5),
+                environment={
+                    "DISTRIBUTION_ID": cf_dist.distribution_id,
+                    "MAX_PATHS": str(params.invalidation_max_paths),
+                },
+            )
+            invalidation_lambda.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=["cloudfront:CreateInvalidation"],
+                    effect=iam.Effect.ALLOW,
+                    resources=[
+                        "arn:aws:cloudfront::"
+                        + self.account
+                        + ":distribution/"
+                        + cf_dist.distribution_id
+                    ],
+                )
+            )
+            invalidation_lambda.add_event_source(
+                lambda_event_sources.SqsEventSource(
+                    invalidation_queue,
+                    batch_size=1000,
+                    max_batching_window=cdk.Duration.seconds(
+                        params.invalidation_window
+                    ),
+                )
+            )
+
+            # paths that failed 10 times are never invalidated, so make it
+            # visible in CloudWatch
+            cloudwatch.Alarm(
+                self,
+                "InvalidationDeadLetterAlarm",
+                alarm_description="CloudFront invalidations failed for "
+                + params.name_prefix
+                + ", see the InvalidationHandler logs",
+                metric=invalidation_dlq.metric_approximate_number_of_messages_visible(
+                    period=cdk.Duration.minutes(5)
+                ),
+                threshold=1,
+                evaluation_periods=1,
+                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+            )
+
+            NagSuppressions.add_resource_suppressions(
+                invalidation_dlq,
+                suppressions=[
+                    NagPackSuppression(
+                        id="AwsSolutions-SQS3",
+                        reason="This is the invalidation queue's dead letter queue",
+                    ),
+                ],
+            )
+            NagSuppressions.add_resource_suppressions(
+                invalidation_lambda,
+                suppressions=[
+                    NagPackSuppression(
+                        id="AwsSolutions-L1",
+                        reason="Same runtime as the compute stack",
+                    ),
+                    NagPackSuppression(
+                        id="AwsSolutions-IAM4",
+                        reason="AWS managed policy for Lambda logging",
+                    ),
+                ],
+                apply_to_children=True,
+            )
+
         route53.CfnRecordSet(
             self,
             "MainRecordset",
@@ -278,8 +550,8 @@ function handler(event) {
             alias_target=route53.CfnRecordSet.AliasTargetProperty(
                 dns_name=cf_dist.domain_name, hosted_zone_id="Z2FDTNDATAQYW2"
             ),
-            name=params["site_hostname"],
-            hosted_zone_id=params["hosted_zone_id"],
+            name=params.site_hostname,
+            hosted_zone_id=params.hosted_zone_id,
         )
 
         NagSuppressions.add_resource_suppressions(
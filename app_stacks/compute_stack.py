@@ -11,13 +11,16 @@ from aws_cdk import (
     aws_kms as kms,
     aws_elasticloadbalancingv2 as elbv2,
     aws_efs as efs,
+    aws_elasticache as elasticache,
     aws_secretsmanager as secretsmanager,
     aws_lambda as aws_lambda,
     aws_certificatemanager as acm,
     aws_route53 as route53,
     aws_logs as logs,
+    aws_events as events,
 )
 import aws_cdk as cdk
+import json
 import re
 from aws_cdk import CustomResource
 import aws_cdk.custom_resources as cr
@@ -25,6 +28,256 @@ from os import path
 from constructs import Construct
 from cdk_nag import NagSuppressions, NagPackSuppression
 
+from app_config.parameters import AppParams
+from app_config.tuning import instance_resources
+
+WARM_POOL_STATES = {
+    "stopped": autoscaling.PoolState.STOPPED,
+    "hibernated": autoscaling.PoolState.HIBERNATED,
+    "running": autoscaling.PoolState.RUNNING,
+}
+# room on a hibernated instance's root volume for the OS and app, on top of
+# the RAM written to it
+HIBERNATION_HEADROOM_GB = 8
+EFS_THROUGHPUT_MODES = {
+    "elastic": efs.ThroughputMode.ELASTIC,
+    "provisioned": efs.ThroughputMode.PROVISIONED,
+    "bursting": efs.ThroughputMode.BURSTING,
+}
+EFS_PERFORMANCE_MODES = {
+    "general_purpose": efs.PerformanceMode.GENERAL_PURPOSE,
+    "max_io": efs.PerformanceMode.MAX_IO,
+}
+
+
+def lifecycle_hook_commands(hook_name: str, region: str) -> list:
+    """User data that installs a service to complete the launch lifecycle hook.
+
+    Instances going into and coming out of a warm pool both wait on the hook,
+    but user data only runs on the first boot, so the service polls the
+    target lifecycle state and completes the hook each time it changes.
+    """
+    return [
+        "cat > /usr/local/bin/complete-lifecycle-hook <<'EOF'",
+        "#!/bin/bash",
+        "LAST_STATE=",
+        "while true",
+        "do",
+        '  TOKEN=$(curl -s -X PUT http://169.254.169.254/latest/api/token -H "X-aws-ec2-metadata-token-ttl-seconds: 60")',
+        '  STATE=$(curl -s -H "X-aws-ec2-metadata-token: $TOKEN" http://169.254.169.254/latest/meta-data/autoscaling/target-lifecycle-state)',
+        '  if [ -n "$STATE" ] && [ "$STATE" != "$LAST_STATE" ]',
+        "  then",
+        '    INSTANCE_ID=$(curl -s -H "X-aws-ec2-metadata-token: $TOKEN" http://169.254.169.254/latest/meta-data/instance-id)',
+        "    ASG_NAME=$(aws autoscaling describe-auto-scaling-instances --instance-ids $INSTANCE_ID --region "
+        + region
+        + " --query 'AutoScalingInstances[0].AutoScalingGroupName' --output text)",
+        "    aws autoscaling complete-lifecycle-action --lifecycle-hook-name "
+        + hook_name
+        + " --auto-scaling-group-name $ASG_NAME --instance-id $INSTANCE_ID --lifecycle-action-result CONTINUE --region "
+        + region,
+        "    LAST_STATE=$STATE",
+        "  fi",
+        "  sleep 5",
+        "done",
+        "EOF",
+        "chmod 755 /usr/local/bin/complete-lifecycle-hook",
+        "cat > /etc/systemd/system/complete-lifecycle-hook.service <<'EOF'",
+        "[Unit]",
+        "Description=Complete the Auto Scaling launch lifecycle hook",
+        "After=network-online.target cloud-final.service",
+        "[Service]",
+        "ExecStart=/usr/local/bin/complete-lifecycle-hook",
+        "Restart=always",
+        "[Install]",
+        "WantedBy=multi-user.target",
+        "EOF",
+        "systemctl daemon-reload",
+        "systemctl enable complete-lifecycle-hook",
+        # --no-block, as the service is ordered after the user data finishes
+        "systemctl start --no-block complete-lifecycle-hook",
+    ]
+
+
+def invalidation_commands(queue_url: str) -> list:
+    """User data that installs invalidate-cdn, which queues the CloudFront
+    paths given as arguments to be invalidated in the next batch."""
+    return [
+        "cat > /usr/local/bin/invalidate-cdn <<'EOF'",
+        "#!/bin/bash",
+        "# usage: invalidate-cdn /path/ /other-path/* ...",
+        '[ $# -gt 0 ] || exit 0',
+        "aws sqs send-message --region us-east-1 --queue-url "
+        + queue_url
+        + ' --message-body "$*" --output text --query MessageId',
+        "EOF",
+        "chmod 755 /usr/local/bin/invalidate-cdn",
+    ]
+
+
+def publish_commands(
+    efs_mount_dir: str, watched: list, parameter_name: str, region: str
+) -> list:
+    """User data that installs app-publish, which tells the fleet that the
+    code on EFS has changed by writing a new version to a marker file.
+
+    Changes to the watched files, relative to efs_mount_dir, run app-publish,
+    and with a parameter_name each new version is put in that SSM parameter
+    too. The path units are started by start_commands, once EFS is mounted.
+    """
+    marker = efs_mount_dir + "/.code-version"
+    commands = [
+        "cat > /usr/local/bin/app-publish <<'EOF'",
+        "#!/bin/bash",
+        "date +%s.%N > " + marker,
+        "EOF",
+        "chmod 755 /usr/local/bin/app-publish",
+    ]
+    if watched:
+        commands += [
+            "cat > /etc/systemd/system/app-publish.path <<'EOF'",
+            "[Path]",
+            *["PathChanged=" + efs_mount_dir + "/" + name for name in watched],
+            "[Install]",
+            "WantedBy=multi-user.target",
+            "EOF",
+            "cat > /etc/systemd/system/app-publish.service <<'EOF'",
+            "[Service]",
+            "Type=oneshot",
+            "ExecStart=/usr/local/bin/app-publish",
+            "EOF",
+            "systemctl enable app-publish.path",
+        ]
+    if parameter_name:
+        commands += [
+            "cat > /usr/local/bin/code-version-notify <<'EOF'",
+            "#!/bin/bash",
+            "aws ssm put-parameter --region "
+            + region
+            + " --name "
+            + parameter_name
+            + ' --overwrite --value "$(cat '
+            + marker
+            + ')" --output text',
+            "EOF",
+            "chmod 755 /usr/local/bin/code-version-notify",
+            # whatever writes the marker, eg WordPress, not just app-publish
+            "cat > /etc/systemd/system/code-version-notify.path <<'EOF'",
+            "[Path]",
+            "PathChanged=" + marker,
+            "[Install]",
+            "WantedBy=multi-user.target",
+            "EOF",
+            "cat > /etc/systemd/system/code-version-notify.service <<'EOF'",
+            "[Service]",
+            "Type=oneshot",
+            "ExecStart=/usr/local/bin/code-version-notify",
+            "EOF",
+            "systemctl enable code-version-notify.path",
+        ]
+    return commands + ["systemctl daemon-reload"]
+
+
+def app_sync_commands(
+    efs_mount_dir: str, app_dir: str, user: str, excludes: list
+) -> list:
+    """User data that installs app-sync, which copies the app from EFS to
+    app_dir. It runs at every boot, so an instance that has been stopped
+    catches up, and app-refresh runs it when the admin publishes code."""
+    return [
+        "command -v rsync || yum install -y rsync",
+        "cat > /usr/local/bin/app-sync <<'EOF'",
+        "#!/bin/bash",
+        # here rather than at install, the app's user data may create the user
+        "mkdir -p " + app_dir,
+        "chown " + user + " " + app_dir,
+        "runuser -u "
+        + user
+        + " -- rsync -a --delete "
+        + "".join("--exclude '" + exclude + "' " for exclude in excludes)
+        + efs_mount_dir
+        + "/ "
+        + app_dir
+        + "/",
+        "EOF",
+        "chmod 755 /usr/local/bin/app-sync",
+        "cat > /etc/systemd/system/app-sync.service <<'EOF'",
+        "[Unit]",
+        "Description=Sync the app from EFS",
+        "After=network-online.target remote-fs.target",
+        "[Service]",
+        "Type=oneshot",
+        "ExecStart=/usr/local/bin/app-sync",
+        "[Install]",
+        "WantedBy=multi-user.target",
+        "EOF",
+        "systemctl daemon-reload",
+        "systemctl enable app-sync",
+    ]
+
+
+def refresh_commands(efs_mount_dir: str, watch: bool) -> list:
+    """User data that installs app-refresh, which runs app-sync if there is
+    one, then the executables in /etc/app-refresh.d, eg to restart the app.
+
+    With watch, the app-refresh service runs it each time the marker written
+    by app-publish changes. Otherwise it is run by SSM Run Command, if at all.
+    """
+    commands = [
+        "mkdir -p /etc/app-refresh.d",
+        "cat > /usr/local/bin/app-refresh <<'EOF'",
+        "#!/bin/bash",
+        "refresh() {",
+        "  [ -x /usr/local/bin/app-sync ] && /usr/local/bin/app-sync",
+        "  for HOOK in /etc/app-refresh.d/*",
+        "  do",
+        '    [ -x "$HOOK" ] && "$HOOK"',
+        "  done",
+        "}",
+        'if [ "$1" != "--watch" ]',
+        "then",
+        "  refresh",
+        "  exit 0",
+        "fi",
+        "LAST_VERSION=$(cat " + efs_mount_dir + "/.code-version 2>/dev/null)",
+        "while true",
+        "do",
+        "  sleep 10",
+        "  VERSION=$(cat " + efs_mount_dir + "/.code-version 2>/dev/null)",
+        '  if [ "$VERSION" != "$LAST_VERSION" ]',
+        "  then",
+        "    refresh",
+        "    LAST_VERSION=$VERSION",
+        "  fi",
+        "done",
+        "EOF",
+        "chmod 755 /usr/local/bin/app-refresh",
+    ]
+    if watch:
+        commands += [
+            "cat > /etc/systemd/system/app-refresh.service <<'EOF'",
+            "[Unit]",
+            "Description=Refresh the app when the admin instance publishes code",
+            "After=network-online.target remote-fs.target",
+            "[Service]",
+            "ExecStart=/usr/local/bin/app-refresh --watch",
+            "Restart=always",
+            "[Install]",
+            "WantedBy=multi-user.target",
+            "EOF",
+            "systemctl daemon-reload",
+            "systemctl enable app-refresh",
+        ]
+    return commands
+
+
+def start_commands(units: list) -> list:
+    """User data that starts units installed at the start of the user data,
+    at the end of it, when EFS is mounted and the app is set up."""
+    if not units:
+        return []
+    # --no-block, as services are ordered after the user data finishes
+    return ["systemctl start --no-block " + " ".join(units)]
+
 
 class ComputeStack(Stack):
     def __init__(
@@ -35,58 +288,71 @@ class ComputeStack(Stack):
         instance_sg: ec2.SecurityGroup,
         alb_sg: ec2.SecurityGroup,
         db_secret_name: str,
-        params: map,
+        params: AppParams,
+        cache_sg: ec2.SecurityGroup = None,
+        db_host_param: str = "",
+        db_read_host_param: str = "",
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        efs_throughput = {
+            "throughput_mode": EFS_THROUGHPUT_MODES[params.efs_throughput_mode]
+        }
+        if params.efs_provisioned_throughput_mb != None:
+            efs_throughput["provisioned_throughput_per_second"] = cdk.Size.mebibytes(
+                params.efs_provisioned_throughput_mb
+            )
+
         efs_fs = efs.FileSystem(
             self,
             "EfsFileSystem",
             vpc=vpc,
             enable_automatic_backups=True,
             encrypted=True,
-            performance_mode=efs.PerformanceMode.GENERAL_PURPOSE,
-            throughput_mode=efs.ThroughputMode.ELASTIC,
+            performance_mode=EFS_PERFORMANCE_MODES[params.efs_performance_mode],
             lifecycle_policy=efs.LifecyclePolicy.AFTER_14_DAYS,  # files are not transitioned to infrequent access (IA) storage by default
             out_of_infrequent_access_policy=efs.OutOfInfrequentAccessPolicy.AFTER_1_ACCESS,
-            file_system_name=params["app_name"]
-            + "-"
-            + params["environment"]
-            + "-filesystem",
+            file_system_name=params.name_prefix + "-filesystem",
             security_group=instance_sg,
             removal_policy=cdk.RemovalPolicy.RETAIN,
             vpc_subnets=ec2.SubnetSelection(
                 subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
             ),
+            **efs_throughput,
         )
 
-        if params["efs_provisioned_throughput_mb"] != '':
-            efs_fs = efs.FileSystem(
-                self,
-                "EfsFileSystem",
-                vpc=vpc,
-                enable_automatic_backups=True,
-                encrypted=True,
-                performance_mode=efs.PerformanceMode.GENERAL_PURPOSE,
-                throughput_mode=efs.ThroughputMode.PROVISIONED,
-                provisioned_throughput_per_second=cdk.Size.mebibytes(
-                    int(params["efs_provisioned_throughput_mb"])
-                ),
-                lifecycle_policy=efs.LifecyclePolicy.AFTER_14_DAYS,  # files are not transitioned to infrequent access (IA) storage by default
-                out_of_infrequent_access_policy=efs.OutOfInfrequentAccessPolicy.AFTER_1_ACCESS,
-                file_system_name=params["app_name"]
-                + "-"
-                + params["environment"]
-                + "-filesystem",
-                security_group=instance_sg,
-                removal_policy=cdk.RemovalPolicy.RETAIN,
-                vpc_subnets=ec2.SubnetSelection(
-                    subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
-                ),
+        efs_fs.connections.allow_default_port_internally()
+
+        # each ASG mounts through its own access point, and can only mount
+        # through that one
+        admin_access_point = None
+        fleet_access_point = None
+        if params.efs_access_points:
+            access_point_options = {"path": params.efs_access_point_path}
+            if params.efs_posix_user:
+                uid, gid = [str(part) for part in params.efs_posix_user]
+                access_point_options["posix_user"] = efs.PosixUser(uid=uid, gid=gid)
+            if params.efs_access_point_path != "/":
+                # created on first use, owned by the POSIX user or root
+                uid, gid = [str(part) for part in params.efs_posix_user or [0, 0]]
+                access_point_options["create_acl"] = efs.Acl(
+                    owner_uid=uid, owner_gid=gid, permissions="755"
+                )
+            admin_access_point = efs_fs.add_access_point(
+                "AdminAccessPoint", **access_point_options
+            )
+            fleet_access_point = efs_fs.add_access_point(
+                "FleetAccessPoint", **access_point_options
             )
 
-        efs_fs.connections.allow_default_port_internally()
+        def efs_conditions(access_point):
+            conditions = {"Bool": {"elasticfilesystem:AccessedViaMountTarget": "true"}}
+            if access_point:
+                conditions["StringEquals"] = {
+                    "elasticfilesystem:AccessPointArn": access_point.access_point_arn
+                }
+            return conditions
 
         db_secret_command = ""
         db_secret = None
@@ -103,6 +369,72 @@ class ComputeStack(Stack):
                 + " --query SecretString --output text"
             )
 
+        cache_endpoint = ""
+        cache_port = ""
+
+        if params.cache_engine and cache_sg != None:
+            cache_subnets = elasticache.CfnSubnetGroup(
+                self,
+                "CacheSubnetGroup",
+                description="Subnet group for the " + params.name_prefix + " cache",
+                subnet_ids=vpc.select_subnets(
+                    subnet_type=ec2.SubnetType.PRIVATE_ISOLATED
+                ).subnet_ids,
+            )
+
+            cache = elasticache.CfnReplicationGroup(
+                self,
+                "CacheReplicationGroup",
+                replication_group_description=params.name_prefix + " object cache",
+                engine=params.cache_engine,
+                cache_node_type=params.cache_node_type,
+                num_cache_clusters=params.cache_nodes,
+                # a replica can only be promoted if there is one
+                automatic_failover_enabled=params.cache_nodes > 1,
+                multi_az_enabled=params.cache_nodes > 1,
+                port=params.cache_port,
+                cache_subnet_group_name=cache_subnets.ref,
+                security_group_ids=[cache_sg.security_group_id],
+                at_rest_encryption_enabled=True,
+                transit_encryption_enabled=True,
+            )
+
+            cache_endpoint = cache.attr_primary_end_point_address
+            cache_port = cache.attr_primary_end_point_port
+
+            cache_suppressions = [
+                NagPackSuppression(
+                    id="AwsSolutions-AEC5",
+                    reason="Want default port because not always possible to reconfigure the app to use non-standard port",
+                ),
+                NagPackSuppression(
+                    id="AwsSolutions-AEC6",
+                    reason="Access is limited to the instance security group and traffic is encrypted in transit",
+                ),
+            ]
+            if params.cache_nodes == 1:
+                cache_suppressions.append(
+                    NagPackSuppression(
+                        id="AwsSolutions-AEC4",
+                        reason="A single cache node was chosen with cacheNodes=1",
+                    )
+                )
+            NagSuppressions.add_resource_suppressions(
+                cache, suppressions=cache_suppressions
+            )
+
+        # the database stack publishes these, they are resolved at deploy time
+        db_host = ""
+        db_read_host = ""
+        if db_host_param != "":
+            db_host = ssm.StringParameter.value_for_string_parameter(
+                self, db_host_param
+            )
+        if db_read_host_param != "":
+            db_read_host = ssm.StringParameter.value_for_string_parameter(
+                self, db_read_host_param
+            )
+
         admin_instance_role = iam.Role(
             self, "InstanceRole", assumed_by=iam.ServicePrincipal("ec2.amazonaws.com")
         )
@@ -125,13 +457,65 @@ class ComputeStack(Stack):
                         ],
                         effect=iam.Effect.ALLOW,
                         resources=[efs_fs.file_system_arn],
-                        conditions={
-                            "Bool": {"elasticfilesystem:AccessedViaMountTarget": "true"}
-                        },
+                        conditions=efs_conditions(admin_access_point),
                     )
                 ],
             )
         )
+        # the media bucket is in the cdn stack, deployed after this one
+        media_bucket = ""
+        if params.media_bucket:
+            media_bucket = params.media_bucket_name
+            admin_instance_role.add_to_policy(
+                iam.PolicyStatement(
+                    actions=["s3:ListBucket"],
+                    effect=iam.Effect.ALLOW,
+                    resources=["arn:aws:s3:::" + media_bucket],
+                )
+            )
+            admin_instance_role.add_to_policy(
+                iam.PolicyStatement(
+                    actions=["s3:GetObject", "s3:PutObject", "s3:DeleteObject"],
+                    effect=iam.Effect.ALLOW,
+                    resources=["arn:aws:s3:::" + media_bucket + "/*"],
+                )
+            )
+
+        # the invalidation queue is in the cdn stack too
+        invalidation_queue_url = ""
+        if params.cdn_invalidation:
+            invalidation_queue_url = (
+                "https://sqs.us-east-1.amazonaws.com/"
+                + self.account
+                + "/"
+                + params.invalidation_queue_name
+            )
+            admin_instance_role.add_to_policy(
+                iam.PolicyStatement(
+                    actions=["sqs:SendMessage"],
+                    effect=iam.Effect.ALLOW,
+                    resources=[
+                        "arn:aws:sqs:us-east-1:"
+                        + self.account
+                        + ":"
+                        + params.invalidation_queue_name
+                    ],
+                )
+            )
+
+        # the admin instance puts each new code version here, and a change
+        # refreshes the fleet through SSM Run Command, see CodeVersionRule
+        code_version_parameter = None
+        if params.publish_events:
+            code_version_parameter = ssm.StringParameter(
+                self,
+                "CodeVersionParameter",
+                parameter_name=params.code_version_parameter,
+                description="The version of the code on EFS, set by app-publish",
+                string_value="0",
+            )
+            code_version_parameter.grant_write(admin_instance_role)
+
         if db_secret != None:
             secrets_policy = iam.ManagedPolicy(
                 self,
@@ -151,9 +535,7 @@ class ComputeStack(Stack):
                             + ":"
                             + self.account
                             + ":secret:"
-                            + params["app_name"].capitalize()
-                            + params["environment"].capitalize()
-                            + "DatabaseSecret*"
+                            + params.resource_prefix + "DatabaseSecret*"
                         ],
                     ),
                     iam.PolicyStatement(
@@ -186,9 +568,16 @@ class ComputeStack(Stack):
             topic=scaling_events_topic, scaling_events=autoscaling.ScalingEvents.ALL
         )
 
-        ami_id = ssm.StringParameter.value_from_lookup(
-            self, parameter_name=params["ami_parameter"]
-        )
+        if params.image_build_commands:
+            # baked by the image stack, and resolved at deploy time so that a
+            # rebuilt image is launched from on the next deploy
+            ami_id = ssm.StringParameter.value_for_string_parameter(
+                self, params.image_ami_param
+            )
+        else:
+            ami_id = ssm.StringParameter.value_from_lookup(
+                self, parameter_name=params.ami_parameter
+            )
 
         app_ami = ec2.MachineImage.generic_linux(
             ami_map={self.region: ami_id},
@@ -196,25 +585,139 @@ class ComputeStack(Stack):
 
         admin_user_data = ec2.UserData.for_linux()
 
-        def interpolate_vars(string):
+        def prepare_for_warm_pool(
+            warm_pool: str, instance_type: str, role, user_data, hook_name: str
+        ):
+            """Signal the lifecycle hook when setup is done, and return the extra
+            launch template settings for the warm pool state."""
+            role.add_to_policy(
+                iam.PolicyStatement(
+                    actions=["autoscaling:DescribeAutoScalingInstances"],
+                    effect=iam.Effect.ALLOW,
+                    resources=["*"],
+                )
+            )
+            role.add_to_policy(
+                iam.PolicyStatement(
+                    actions=["autoscaling:CompleteLifecycleAction"],
+                    effect=iam.Effect.ALLOW,
+                    resources=[
+                        "arn:aws:autoscaling:"
+                        + self.region
+                        + ":"
+                        + self.account
+                        + ":autoScalingGroup:*:autoScalingGroupName/"
+                        + self.stack_name
+                        + "-*"
+                    ],
+                )
+            )
+            user_data.add_commands(*lifecycle_hook_commands(hook_name, self.region))
+            if warm_pool != "hibernated":
+                return {}
+            # hibernation needs an encrypted root volume big enough for the
+            # RAM. load_params only allows types it can size
+            memory_mb = instance_resources(instance_type)[1]
+            return {
+                "hibernation_configured": True,
+                "block_devices": [
+                    ec2.BlockDevice(
+                        device_name="/dev/xvda",
+                        volume=ec2.BlockDeviceVolume.ebs(
+                            -(-memory_mb // 1024) + HIBERNATION_HEADROOM_GB,
+                            encrypted=True,
+                            volume_type=ec2.EbsDeviceVolumeType.GP3,
+                        ),
+                    )
+                ],
+            }
+
+        # role_vars are admin_vars or fleet_vars, so each ASG's user data is
+        # sized for its own instance type and runs the app from its own place
+        admin_vars = dict(
+            params.admin_tuning,
+            app_dir=params.efs_mount_dir,
+            sync_app_dir="true",
+            efs_mount_options="tls,iam",
+        )
+        fleet_vars = dict(
+            params.fleet_tuning,
+            app_dir=params.fleet_app_dir,
+            sync_app_dir="true",
+            efs_mount_options="tls,iam",
+        )
+        if params.efs_access_points:
+            admin_vars["efs_mount_options"] = (
+                "tls,iam,accesspoint=" + admin_access_point.access_point_id
+            )
+            # the fleet can't write to EFS anyway
+            fleet_vars["efs_mount_options"] = (
+                "tls,iam,ro,accesspoint=" + fleet_access_point.access_point_id
+            )
+        if params.fleet_local_sync:
+            # the first copy, app-refresh keeps it up to date
+            fleet_vars["sync_app_dir"] = "/usr/local/bin/app-sync"
+
+        def interpolate_vars(string, role_vars):
             return string.format(
+                **role_vars,
                 efs_fs_id=efs_fs.file_system_id,
-                efs_mount_dir=params["efs_mount_dir"],
-                site_hostname=params["site_hostname"],
+                efs_mount_dir=params.efs_mount_dir,
+                site_hostname=params.site_hostname,
                 db_secret_command=db_secret_command,
+                db_host=db_host,
+                db_read_host=db_read_host,
+                cache_endpoint=cache_endpoint,
+                cache_port=cache_port,
+                media_bucket=media_bucket,
+                invalidation_queue_url=invalidation_queue_url,
+                opcache_preload_dirs=" ".join(params.fleet_opcache_preload),
             )
 
+        # before the app's own user data, so that can use them
         admin_user_data.add_commands(
-            *list(map(interpolate_vars, params["admin_user_data"]))
+            *publish_commands(
+                params.efs_mount_dir,
+                params.admin_publish_watch,
+                code_version_parameter.parameter_name if code_version_parameter else "",
+                self.region,
+            )
         )
+        if params.cdn_invalidation:
+            admin_user_data.add_commands(*invalidation_commands(invalidation_queue_url))
 
-        if params["admin_user_data_script"] and path.exists(
-            "./userdata/" + params["admin_user_data_script"]
+        admin_user_data.add_commands(
+            *[
+                interpolate_vars(command, admin_vars)
+                for command in params.admin_user_data
+            ]
+        )
+
+        if params.admin_user_data_script and path.exists(
+            "./userdata/" + params.admin_user_data_script
         ):
             userdata_file = open(
-                "./userdata/" + params["admin_user_data_script"], "r"
+                "./userdata/" + params.admin_user_data_script, "r"
             ).read()
-            admin_user_data.add_commands(interpolate_vars(str(userdata_file)))
+            admin_user_data.add_commands(
+                interpolate_vars(str(userdata_file), admin_vars)
+            )
+        admin_user_data.add_commands(
+            *start_commands(
+                (["app-publish.path"] if params.admin_publish_watch else [])
+                + (["code-version-notify.path"] if code_version_parameter else [])
+            )
+        )
+
+        admin_launch_options = {}
+        if params.admin_warm_pool:
+            admin_launch_options = prepare_for_warm_pool(
+                params.admin_warm_pool,
+                params.admin_instance_type,
+                admin_instance_role,
+                admin_user_data,
+                params.name_prefix + "-admin-launch",
+            )
 
         admin_asg = autoscaling.AutoScalingGroup(
             self,
@@ -224,35 +727,48 @@ class ComputeStack(Stack):
                 subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
             ),
             health_check=autoscaling.HealthCheck.elb(
-                grace=cdk.Duration.minutes(int(params["admin_build_time"]))
+                grace=cdk.Duration.minutes(params.admin_build_time)
             ),
             launch_template=ec2.LaunchTemplate(
                 self,
-                params["app_name"].capitalize()
-                + params["environment"].capitalize()
-                + "AdminLaunchTemplate",
+                params.resource_prefix + "AdminLaunchTemplate",
                 role=admin_instance_role,
                 user_data=admin_user_data,
                 ebs_optimized=True,
                 machine_image=app_ami,
                 security_group=instance_sg,
                 instance_type=ec2.InstanceType(
-                    instance_type_identifier=params["admin_instance_type"]
+                    instance_type_identifier=params.admin_instance_type
                 ),
+                **admin_launch_options,
             ),
-            min_capacity=params["min_max_admin_instances"][0],
-            max_capacity=params["min_max_admin_instances"][1],
+            min_capacity=params.min_max_admin_instances[0],
+            max_capacity=params.min_max_admin_instances[1],
             notifications=[notification_configuration],
             update_policy=autoscaling.UpdatePolicy.replacing_update(),
         )
 
+        if params.admin_warm_pool:
+            admin_asg.add_lifecycle_hook(
+                "AdminLaunchHook",
+                lifecycle_hook_name=params.name_prefix + "-admin-launch",
+                lifecycle_transition=autoscaling.LifecycleTransition.INSTANCE_LAUNCHING,
+                default_result=autoscaling.DefaultResult.CONTINUE,
+                heartbeat_timeout=cdk.Duration.minutes(params.admin_build_time),
+            )
+            admin_asg.add_warm_pool(
+                min_size=params.admin_warm_pool_size,
+                pool_state=WARM_POOL_STATES[params.admin_warm_pool],
+                reuse_on_scale_in=True,
+            )
+
         write_targets = elbv2.ApplicationTargetGroup(
             self,
             "WriteTarget",
             targets=[admin_asg],
             protocol_version=elbv2.ApplicationProtocolVersion.HTTP1,
             protocol=elbv2.ApplicationProtocol.HTTP,
-            port=int(params["target_port"]),
+            port=params.target_port,
             health_check=elbv2.HealthCheck(
                 enabled=True,
                 unhealthy_threshold_count=5,
@@ -260,7 +776,7 @@ class ComputeStack(Stack):
                 timeout=cdk.Duration.seconds(10),
                 interval=cdk.Duration.seconds(30),
                 path="/",
-                port=params["target_port"],
+                port=str(params.target_port),
                 healthy_http_codes="200-302",
             ),
             vpc=vpc,
@@ -295,9 +811,7 @@ class ComputeStack(Stack):
                             + ":file-system/"
                             + efs_fs.file_system_id
                         ],
-                        conditions={
-                            "Bool": {"elasticfilesystem:AccessedViaMountTarget": "true"}
-                        },
+                        conditions=efs_conditions(fleet_access_point),
                     ),
                     iam.PolicyStatement(
                         actions=[
@@ -332,17 +846,85 @@ class ComputeStack(Stack):
         )
 
         fleet_user_data = ec2.UserData.for_linux()
+        if params.fleet_local_sync:
+            fleet_user_data.add_commands(
+                *app_sync_commands(
+                    params.efs_mount_dir,
+                    params.fleet_app_dir,
+                    params.fleet_sync_user,
+                    params.fleet_sync_exclude,
+                )
+            )
+
+        fleet_user_data.add_commands(
+            *refresh_commands(params.efs_mount_dir, watch=params.fleet_refresh_watch)
+        )
 
         fleet_user_data.add_commands(
-            *list(map(interpolate_vars, params["fleet_user_data"]))
+            *[
+                interpolate_vars(command, fleet_vars)
+                for command in params.fleet_user_data
+            ]
         )
-        if params["fleet_user_data_script"] and path.exists(
-            "./userdata/" + params["fleet_user_data_script"]
+        if params.fleet_user_data_script and path.exists(
+            "./userdata/" + params.fleet_user_data_script
         ):
             userdata_file = open(
-                "./userdata/" + params["fleet_user_data_script"], "rb"
+                "./userdata/" + params.fleet_user_data_script, "rb"
             ).read()
-            fleet_user_data.add_commands(interpolate_vars(str(userdata_file, 'utf-8')))
+            fleet_user_data.add_commands(
+                interpolate_vars(str(userdata_file, 'utf-8'), fleet_vars)
+            )
+        fleet_user_data.add_commands(
+            *start_commands(["app-refresh"] if params.fleet_refresh_watch else [])
+        )
+
+        fleet_launch_options = {}
+        if params.fleet_warm_pool:
+            fleet_launch_options = prepare_for_warm_pool(
+                params.fleet_warm_pool,
+                params.fleet_instance_type,
+                fleet_instance_role,
+                fleet_user_data,
+                params.name_prefix + "-fleet-launch",
+            )
+
+        fleet_launch_template = ec2.LaunchTemplate(
+            self,
+            params.resource_prefix + "FleetLaunchTemplate",
+            role=fleet_instance_role,
+            user_data=fleet_user_data,
+            ebs_optimized=True,
+            machine_image=app_ami,
+            security_group=instance_sg,
+            instance_type=ec2.InstanceType(
+                instance_type_identifier=params.fleet_instance_type
+            ),
+            **fleet_launch_options,
+        )
+
+        # the fleet only reads from EFS, so it can run on a mix of instance
+        # types and on Spot capacity
+        fleet_instances = {"launch_template": fleet_launch_template}
+        if params.fleet_mixed_instances:
+            fleet_instances = {
+                "mixed_instances_policy": autoscaling.MixedInstancesPolicy(
+                    launch_template=fleet_launch_template,
+                    launch_template_overrides=[
+                        autoscaling.LaunchTemplateOverrides(
+                            instance_type=ec2.InstanceType(instance_type)
+                        )
+                        for instance_type in [params.fleet_instance_type]
+                        + params.fleet_extra_instance_types
+                    ],
+                    instances_distribution=autoscaling.InstancesDistribution(
+                        on_demand_base_capacity=params.fleet_on_demand_base,
+                        on_demand_percentage_above_base_capacity=params.fleet_on_demand_percentage,
+                        on_demand_allocation_strategy=autoscaling.OnDemandAllocationStrategy.PRIORITIZED,
+                        spot_allocation_strategy=autoscaling.SpotAllocationStrategy.CAPACITY_OPTIMIZED,
+                    ),
+                ),
+            }
 
         fleet_asg = autoscaling.AutoScalingGroup(
             self,
@@ -352,35 +934,119 @@ class ComputeStack(Stack):
                 subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
             ),
             health_check=autoscaling.HealthCheck.elb(
-                grace=cdk.Duration.minutes(int(params["fleet_build_time"]))
-            ),
-            launch_template=ec2.LaunchTemplate(
-                self,
-                params["app_name"].capitalize()
-                + params["environment"].capitalize()
-                + "FleetLaunchTemplate",
-                role=fleet_instance_role,
-                user_data=fleet_user_data,
-                ebs_optimized=True,
-                machine_image=app_ami,
-                security_group=instance_sg,
-                instance_type=ec2.InstanceType(
-                    instance_type_identifier=params["admin_instance_type"]
-                ),
+                grace=cdk.Duration.minutes(params.fleet_build_time)
             ),
-            min_capacity=params["min_max_fleet_instances"][0],
-            max_capacity=params["min_max_fleet_instances"][1],
+            min_capacity=params.min_max_fleet_instances[0],
+            max_capacity=params.min_max_fleet_instances[1],
             notifications=[notification_configuration],
             update_policy=autoscaling.UpdatePolicy.replacing_update(),
+            **fleet_instances,
         )
 
+        if params.fleet_mixed_instances and params.fleet_on_demand_percentage < 100:
+            # launch a replacement when a Spot instance is at risk of
+            # interruption. not an AutoScalingGroup argument in this CDK version
+            fleet_asg.node.default_child.capacity_rebalance = True
+
+        if params.fleet_warm_pool:
+            fleet_asg.add_lifecycle_hook(
+                "FleetLaunchHook",
+                lifecycle_hook_name=params.name_prefix + "-fleet-launch",
+                lifecycle_transition=autoscaling.LifecycleTransition.INSTANCE_LAUNCHING,
+                default_result=autoscaling.DefaultResult.CONTINUE,
+                heartbeat_timeout=cdk.Duration.minutes(params.fleet_build_time),
+            )
+            fleet_asg.add_warm_pool(
+                min_size=params.fleet_warm_pool_size,
+                pool_state=WARM_POOL_STATES[params.fleet_warm_pool],
+                reuse_on_scale_in=True,
+            )
+
+        if code_version_parameter:
+            run_command_role = iam.Role(
+                self,
+                "CodeVersionRunCommandRole",
+                assumed_by=iam.ServicePrincipal("events.amazonaws.com"),
+            )
+            run_command_role.add_to_policy(
+                iam.PolicyStatement(
+                    actions=["ssm:SendCommand"],
+                    effect=iam.Effect.ALLOW,
+                    resources=[
+                        "arn:aws:ssm:" + self.region + "::document/AWS-RunShellScript"
+                    ],
+                )
+            )
+            run_command_role.add_to_policy(
+                iam.PolicyStatement(
+                    actions=["ssm:SendCommand"],
+                    effect=iam.Effect.ALLOW,
+                    resources=[
+                        "arn:aws:ec2:"
+                        + self.region
+                        + ":"
+                        + self.account
+                        + ":instance/*"
+                    ],
+                    conditions={
+                        "StringEquals": {
+                            "ssm:resourceTag/aws:autoscaling:groupName": fleet_asg.auto_scaling_group_name
+                        }
+                    },
+                )
+            )
+            NagSuppressions.add_resource_suppressions(
+                run_command_role,
+                suppressions=[
+                    NagPackSuppression(
+                        id="AwsSolutions-IAM5",
+                        reason="Fleet instances come and go, they are limited to the fleet ASG by its tag",
+                    ),
+                ],
+                apply_to_children=True,
+            )
+            # one SendCommand reaches every fleet instance, so EFS isn't
+            # polled by each of them
+            events.CfnRule(
+                self,
+                "CodeVersionRule",
+                description="Refresh the fleet when the admin instance publishes code",
+                event_pattern={
+                    "source": ["aws.ssm"],
+                    "detail-type": ["Parameter Store Change"],
+                    "detail": {
+                        "name": [code_version_parameter.parameter_name],
+                        "operation": ["Update"],
+                    },
+                },
+                state="ENABLED",
+                targets=[
+                    events.CfnRule.TargetProperty(
+                        id="RefreshFleet",
+                        arn="arn:aws:ssm:"
+                        + self.region
+                        + "::document/AWS-RunShellScript",
+                        role_arn=run_command_role.role_arn,
+                        input=json.dumps({"commands": ["/usr/local/bin/app-refresh"]}),
+                        run_command_parameters=events.CfnRule.RunCommandParametersProperty(
+                            run_command_targets=[
+                                events.CfnRule.RunCommandTargetProperty(
+                                    key="tag:aws:autoscaling:groupName",
+                                    values=[fleet_asg.auto_scaling_group_name],
+                                )
+                            ]
+                        ),
+                    )
+                ],
+            )
+
         read_targets = elbv2.ApplicationTargetGroup(
             self,
             "FleetTarget",
             targets=[fleet_asg],
             protocol_version=elbv2.ApplicationProtocolVersion.HTTP1,
             protocol=elbv2.ApplicationProtocol.HTTP,
-            port=int(params["target_port"]),
+            port=params.target_port,
             health_check=elbv2.HealthCheck(
                 enabled=True,
                 unhealthy_threshold_count=5,
@@ -388,7 +1054,7 @@ class ComputeStack(Stack):
                 timeout=cdk.Duration.seconds(10),
                 interval=cdk.Duration.seconds(30),
                 path="/",
-                port=params["target_port"],
+                port=str(params.target_port),
                 healthy_http_codes="200,302",
             ),
             vpc=vpc,
@@ -408,14 +1074,14 @@ class ComputeStack(Stack):
         hosted_zone = route53.HostedZone.from_hosted_zone_attributes(
             self,
             "MyZone",
-            zone_name=params["hosted_zone"],
-            hosted_zone_id=params["hosted_zone_id"],
+            zone_name=params.hosted_zone,
+            hosted_zone_id=params.hosted_zone_id,
         )
 
         alb_cert = acm.Certificate(
             self,
             "AlbSiteCertificate",
-            domain_name=params["site_hostname"],
+            domain_name=params.site_hostname,
             validation=acm.CertificateValidation.from_dns(hosted_zone=hosted_zone),
         )
 
@@ -441,11 +1107,7 @@ class ComputeStack(Stack):
                 generate_string_key="cloudfront_secret", secret_string_template="{}"
             ),
             replica_regions=[secretsmanager.ReplicaRegion(region="us-east-1")],
-            secret_name=params["app_name"]
-            + "-"
-            + params["environment"]
-            + "-"
-            + "cloudfront-secret",
+            secret_name=params.name_prefix + "-cloudfront-secret",
         )
 
         # using unsafe_unwrap here as this secret is not sensitive, and is
@@ -456,7 +1118,7 @@ class ComputeStack(Stack):
 
         # get the list of IPs without the subnet mask
         ip_set = []
-        for ip in params["admin_ips"]:
+        for ip in params.admin_ips:
             ip_set.append(re.sub('/\d+$', '', ip))
 
         alb_listener.add_action(
@@ -482,13 +1144,39 @@ class ComputeStack(Stack):
             priority=5,
         )
 
+        # fleet scaling, the request count policy needs the target group to be
+        # attached to the listener so it has to come after the actions
+        if params.fleet_requests_per_target != None:
+            fleet_asg.scale_on_request_count(
+                "FleetRequestCountScaling",
+                target_requests_per_minute=params.fleet_requests_per_target,
+                estimated_instance_warmup=cdk.Duration.minutes(params.fleet_build_time),
+            )
+
+        if params.fleet_cpu_target != None:
+            fleet_asg.scale_on_cpu_utilization(
+                "FleetCpuScaling",
+                target_utilization_percent=params.fleet_cpu_target,
+                estimated_instance_warmup=cdk.Duration.minutes(params.fleet_build_time),
+            )
+
+        for index, action in enumerate(params.fleet_scheduled_scaling):
+            fleet_asg.scale_on_schedule(
+                "FleetScheduledScaling" + str(index),
+                schedule=autoscaling.Schedule.expression(action["cron"]),
+                min_capacity=action.get("min"),
+                max_capacity=action.get("max"),
+                desired_capacity=action.get("desired"),
+                time_zone=action.get("timezone"),
+            )
+
         # to add an authentication action, add something like the following
         # alb_listener.add_action(
         #     "AuthAction",
         #     action=elbv2.ListenerAction.authenticate_oidc(next=write_action, authorization_endpoint=...),
         #     conditions=[
         #         elbv2.ListenerCondition.http_header(
-        #             name="cloudfront", values=[params["cloudfront_secret"]]
+        #             name="cloudfront", values=[params.cloudfront_secret]
         #         ),
         #         elbv2.ListenerCondition.http_header('true-client-ip', ip_set),
         #     ],
@@ -517,11 +1205,11 @@ class ComputeStack(Stack):
                     "arn:aws:ssm:us-east-1:"
                     + self.account
                     + ":parameter"
-                    + params["alb_hostname_param"],
+                    + params.alb_hostname_param,
                     "arn:aws:ssm:us-east-1:"
                     + self.account
                     + ":parameter"
-                    + params["cloudfront_secret_param"],
+                    + params.cloudfront_secret_param,
                 ],
             )
         )
@@ -551,14 +1239,14 @@ class ComputeStack(Stack):
             service_token=cr_provider.service_token,
             properties={
                 "alb_hostname": alb.load_balancer_dns_name,
-                "alb_parameter_name": params["alb_hostname_param"],
+                "alb_parameter_name": params.alb_hostname_param,
                 "cf_secret_value": cdk.Fn.select(
                     index=6,
                     array=cdk.Fn.split(
                         delimiter=":", source=cloudfront_secret.secret_full_arn
                     ),
                 ),
-                "cf_parameter_name": params["cloudfront_secret_param"],
+                "cf_parameter_name": params.cloudfront_secret_param,
             },
         )
 
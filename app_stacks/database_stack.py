@@ -7,19 +7,27 @@ import aws_cdk as cdk
 from cdk_nag import NagSuppressions, NagPackSuppression
 
 from aws_cdk import aws_ec2 as ec2, aws_rds as rds, aws_ssm as ssm
+from aws_cdk import aws_applicationautoscaling as appscaling
 import re
 
+from app_config.parameters import AppParams
+
 
 class DatabaseStack(Stack):
     def __init__(
-        self, scope: Construct, construct_id: str, params: map, **kwargs
+        self, scope: Construct, construct_id: str, params: AppParams, **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         self.security_group = None
         self.db = None
+        self.proxy = None
+        # the hosts the instances should connect to for writes and reads,
+        # "" if we don't create a database
+        self.db_host = ""
+        self.db_read_host = ""
 
-        if "db_config" in params and params["db_config"] == "":
+        if params.db_config == "":
             return
 
         # use tags to get the VPC because exports are only tokens at synth time
@@ -49,38 +57,33 @@ class DatabaseStack(Stack):
         )
         db_engine = rds.DatabaseInstanceEngine.mysql(
             version=rds.MysqlEngineVersion.of(
-                mysql_major_version=params["db_major_version"],
-                mysql_full_version=params["db_full_version"],
+                mysql_major_version=params.db_major_version,
+                mysql_full_version=params.db_full_version,
             )
         )
         db_logging = ["audit", "error", "general", "slowquery"]
-        if params["db_engine"] == "postgres":
+        if params.db_engine == "postgres":
             db_engine = rds.DatabaseInstanceEngine.postgres(
                 version=rds.PostgresEngineVersion.of(
-                    postgres_major_version=params["db_major_version"],
-                    postgres_full_version=params["db_full_version"],
+                    postgres_major_version=params.db_major_version,
+                    postgres_full_version=params.db_full_version,
                 )
             )
             db_logging = []
 
-        if "db_config" in params and params["db_config"] == "instance":
-            if (
-                "db_snapshot_id" in params
-                and re.search('snapshot', params["db_snapshot_id"]) != None
-            ):
+        if params.db_config == "instance":
+            if re.search('snapshot', params.db_snapshot_id) != None:
                 self.db = rds.DatabaseInstanceFromSnapshot(
                     self,
-                    params["app_name"].capitalize()
-                    + params["environment"].capitalize()
-                    + "Database",
+                    params.resource_prefix + "Database",
                     cloudwatch_logs_exports=db_logging,
-                    deletion_protection=params["prevent_deletion"],
+                    deletion_protection=params.prevent_deletion,
                     engine=db_engine,
                     multi_az=True,
                     storage_encrypted=True,
-                    snapshot_identifier=params["db_snapshot_id"],
+                    snapshot_identifier=params.db_snapshot_id,
                     instance_type=ec2.InstanceType(
-                        instance_type_identifier=params["db_instance_type"]
+                        instance_type_identifier=params.db_instance_type
                     ),
                     vpc_subnets=ec2.SubnetSelection(
                         subnet_type=ec2.SubnetType.PRIVATE_ISOLATED,
@@ -93,17 +96,15 @@ class DatabaseStack(Stack):
             else:
                 self.db = rds.DatabaseInstance(
                     self,
-                    params["app_name"].capitalize()
-                    + params["environment"].capitalize()
-                    + "Database",
+                    params.resource_prefix + "Database",
                     cloudwatch_logs_exports=db_logging,
-                    deletion_protection=params["prevent_deletion"],
+                    deletion_protection=params.prevent_deletion,
                     engine=db_engine,
-                    database_name=params["app_name"],
+                    database_name=params.app_name,
                     multi_az=True,
                     storage_encrypted=True,
                     instance_type=ec2.InstanceType(
-                        instance_type_identifier=params["db_instance_type"]
+                        instance_type_identifier=params.db_instance_type
                     ),
                     vpc_subnets=ec2.SubnetSelection(
                         subnet_type=ec2.SubnetType.PRIVATE_ISOLATED,
@@ -113,18 +114,13 @@ class DatabaseStack(Stack):
                     subnet_group=rds_subnet,
                     backup_retention=cdk.Duration.days(35),
                 )
-        elif "db_config" in params and params["db_config"] == "cluster":
-            if (
-                "db_snapshot_id" in params
-                and re.search('snapshot', params["db_snapshot_id"]) != None
-            ):
+        elif params.db_config == "cluster":
+            if re.search('snapshot', params.db_snapshot_id) != None:
                 self.db = rds.DatabaseClusterFromSnapshot(
                     self,
-                    params["app_name"].capitalize()
-                    + params["environment"].capitalize()
-                    + "Database",
+                    params.resource_prefix + "Database",
                     backtrack_window=cdk.Duration.hours(72),
-                    deletion_protection=params["prevent_deletion"],
+                    deletion_protection=params.prevent_deletion,
                     cloudwatch_logs_exports=db_logging,
                     engine=rds.DatabaseClusterEngine.AURORA_MYSQL,
                     parameter_group=rds.ParameterGroup(
@@ -136,13 +132,13 @@ class DatabaseStack(Stack):
                             "aurora_disable_hash_join": "OFF",
                         },
                     ),
-                    default_database_name=params["app_name"],
-                    snapshot_identifier=params["db_snapshot_id"],
-                    instances=params["db_cluster_size"][params["environment"]],
+                    default_database_name=params.app_name,
+                    snapshot_identifier=params.db_snapshot_id,
+                    instances=params.db_cluster_size,
                     storage_encrypted=True,
                     instance_props=rds.InstanceProps(
                         instance_type=ec2.InstanceType(
-                            instance_type_identifier=params["db_instance_type"]
+                            instance_type_identifier=params.db_instance_type
                         ),
                         vpc_subnets=ec2.SubnetSelection(
                             subnet_type=ec2.SubnetType.PRIVATE_ISOLATED,
@@ -159,25 +155,23 @@ class DatabaseStack(Stack):
                     "AppnameDatabaseCluster",
                     backtrack_window=cdk.Duration.hours(72),
                     cloudwatch_logs_exports=db_logging,
-                    deletion_protection=params["prevent_deletion"],
+                    deletion_protection=params.prevent_deletion,
                     engine=rds.DatabaseClusterEngine.AURORA_MYSQL,
                     parameter_group=rds.ParameterGroup(
                         self,
-                        params["app_name"].capitalize()
-                        + params["environment"].capitalize()
-                        + "Database",
+                        params.resource_prefix + "Database",
                         engine=rds.DatabaseClusterEngine.AURORA_MYSQL,
                         parameters={
                             "aurora_parallel_query": "ON",
                             "aurora_disable_hash_join": "OFF",
                         },
                     ),
-                    default_database_name=params["app_name"],
-                    instances=params["db_cluster_size"][params["environment"]],
+                    default_database_name=params.app_name,
+                    instances=params.db_cluster_size,
                     storage_encrypted=True,
                     instance_props=rds.InstanceProps(
                         instance_type=ec2.InstanceType(
-                            instance_type_identifier=params["db_instance_type"]
+                            instance_type_identifier=params.db_instance_type
                         ),
                         vpc_subnets=ec2.SubnetSelection(
                             subnet_type=ec2.SubnetType.PRIVATE_ISOLATED,
@@ -189,19 +183,105 @@ class DatabaseStack(Stack):
                     backup=rds.BackupProps(retention=cdk.Duration.days(35)),
                 )
 
+        if params.db_config == "cluster" and params.db_replica_min_max != None:
+            # replicas added by auto scaling count towards, and are created
+            # alongside, the db_cluster_size - 1 replicas in the template
+            replicas = appscaling.ScalableTarget(
+                self,
+                "ReplicaScalableTarget",
+                service_namespace=appscaling.ServiceNamespace.RDS,
+                scalable_dimension="rds:cluster:ReadReplicaCount",
+                resource_id="cluster:" + self.db.cluster_identifier,
+                min_capacity=params.db_replica_min_max[0],
+                max_capacity=params.db_replica_min_max[1],
+            )
+            replicas.scale_to_track_metric(
+                "ReplicaCpuTracking",
+                predefined_metric=appscaling.PredefinedMetric.RDS_READER_AVERAGE_CPU_UTILIZATION,
+                target_value=params.db_replica_cpu_target,
+                # new replicas take several minutes to come into service
+                scale_out_cooldown=cdk.Duration.minutes(5),
+                scale_in_cooldown=cdk.Duration.minutes(15),
+            )
+            if params.db_replica_connections_target != None:
+                replicas.scale_to_track_metric(
+                    "ReplicaConnectionsTracking",
+                    predefined_metric=appscaling.PredefinedMetric.RDS_READER_AVERAGE_DATABASE_CONNECTIONS,
+                    target_value=params.db_replica_connections_target,
+                    scale_out_cooldown=cdk.Duration.minutes(5),
+                    scale_in_cooldown=cdk.Duration.minutes(15),
+                )
+
         if self.db:
             ssm.StringParameter(
                 self,
                 "DbSecret",
                 string_value=self.db.secret.secret_name,
-                parameter_name="/"
-                + params["app_name"]
-                + "/"
-                + params["environment"]
-                + "/DatabaseSecret",
+                parameter_name=params.db_secret_param,
+            )
+
+            if params.db_config == "cluster":
+                self.db_host = self.db.cluster_endpoint.hostname
+                self.db_read_host = self.db.cluster_read_endpoint.hostname
+                proxy_target = rds.ProxyTarget.from_cluster(self.db)
+            else:
+                # no replicas, so reads go to the instance as well
+                self.db_host = self.db.db_instance_endpoint_address
+                self.db_read_host = self.db_host
+                proxy_target = rds.ProxyTarget.from_instance(self.db)
+
+            if params.db_proxy:
+                # pools connections from the fleet so scale-outs don't exhaust
+                # max_connections, and hides cluster failovers from the app
+                self.proxy = rds.DatabaseProxy(
+                    self,
+                    "DatabaseProxy",
+                    proxy_target=proxy_target,
+                    secrets=[self.db.secret],
+                    db_proxy_name=params.name_prefix + "-proxy",
+                    vpc=vpc,
+                    vpc_subnets=ec2.SubnetSelection(
+                        subnet_type=ec2.SubnetType.PRIVATE_ISOLATED,
+                    ),
+                    security_groups=[database_sg],
+                    # like the database itself, clients in the VPC aren't required to use TLS
+                    require_tls=False,
+                )
+                self.db_host = self.proxy.endpoint
+                self.db_read_host = self.db_host
+
+                if params.db_config == "cluster":
+                    read_only_endpoint = rds.CfnDBProxyEndpoint(
+                        self,
+                        "DatabaseProxyReadOnlyEndpoint",
+                        db_proxy_endpoint_name=params.name_prefix + "-proxy-ro",
+                        db_proxy_name=self.proxy.db_proxy_name,
+                        target_role="READ_ONLY",
+                        vpc_subnet_ids=vpc.select_subnets(
+                            subnet_type=ec2.SubnetType.PRIVATE_ISOLATED
+                        ).subnet_ids,
+                        vpc_security_group_ids=[database_sg.security_group_id],
+                    )
+                    self.db_read_host = read_only_endpoint.attr_endpoint
+
+            # published as parameters rather than cross-stack exports so that
+            # they can change, eg when the proxy is added, while the compute
+            # stack is using them
+            ssm.StringParameter(
+                self,
+                "DbHost",
+                string_value=self.db_host,
+                parameter_name=params.db_host_param,
+            )
+
+            ssm.StringParameter(
+                self,
+                "DbReadHost",
+                string_value=self.db_read_host,
+                parameter_name=params.db_read_host_param,
             )
 
-        if params["db_config"] != "delete" and params["db_config"] != "none":
+        if params.db_config != "delete" and params.db_config != "none":
             self.db.apply_removal_policy(cdk.RemovalPolicy.SNAPSHOT)
 
             NagSuppressions.add_resource_suppressions(
@@ -0,0 +1,241 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from aws_cdk import (
+    Stack,
+    aws_ec2 as ec2,
+    aws_events as events,
+    aws_events_targets as targets,
+    aws_iam as iam,
+    aws_imagebuilder as imagebuilder,
+    aws_lambda as aws_lambda,
+    aws_logs as logs,
+    aws_ssm as ssm,
+)
+from aws_cdk import CustomResource
+import aws_cdk.custom_resources as cr
+import hashlib
+import json
+from constructs import Construct
+
+from app_config.parameters import AppParams
+
+
+def content_version(*values) -> str:
+    """A semantic version that changes whenever any of the values change.
+
+    Image Builder components and recipes are immutable, so every change
+    needs a new version, and replacing them with the same version fails.
+    """
+    digest = hashlib.sha256(json.dumps(values).encode("utf-8")).hexdigest()
+    return "1.0." + str(int(digest[:7], 16))
+
+
+# bakes imageBuildCommands into an AMI with EC2 Image Builder, and publishes
+# its ID to params.image_ami_param for the compute stack to launch from
+class ImageStack(Stack):
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        vpc: ec2.Vpc,
+        instance_sg: ec2.SecurityGroup,
+        params: AppParams,
+        **kwargs
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        # the same synth-time lookup as the compute stack, so the recipe
+        # version changes when the base image does
+        base_ami_id = ssm.StringParameter.value_from_lookup(
+            self, parameter_name=params.ami_parameter
+        )
+
+        commands = [
+            command.format(
+                efs_mount_dir=params.efs_mount_dir,
+                site_hostname=params.site_hostname,
+            )
+            for command in params.image_build_commands
+        ]
+
+        component_version = content_version(commands)
+        component = imagebuilder.CfnComponent(
+            self,
+            "InstallComponent",
+            name=params.name_prefix + "-install",
+            platform="Linux",
+            version=component_version,
+            data=json.dumps(
+                {
+                    "name": params.name_prefix + "-install",
+                    "schemaVersion": 1.0,
+                    "phases": [
+                        {
+                            "name": "build",
+                            "steps": [
+                                {
+                                    "name": "ImageBuildCommands",
+                                    "action": "ExecuteBash",
+                                    "inputs": {"commands": commands},
+                                }
+                            ],
+                        }
+                    ],
+                },
+                indent=2,
+            ),
+        )
+
+        recipe = imagebuilder.CfnImageRecipe(
+            self,
+            "ImageRecipe",
+            name=params.name_prefix + "-recipe",
+            version=content_version(component_version, base_ami_id),
+            parent_image=base_ami_id,
+            components=[
+                imagebuilder.CfnImageRecipe.ComponentConfigurationProperty(
+                    component_arn=component.attr_arn
+                )
+            ],
+        )
+
+        build_instance_role = iam.Role(
+            self,
+            "BuildInstanceRole",
+            assumed_by=iam.ServicePrincipal("ec2.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "AmazonSSMManagedInstanceCore"
+                ),
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "EC2InstanceProfileForImageBuilder"
+                ),
+            ],
+        )
+        build_instance_profile = iam.CfnInstanceProfile(
+            self,
+            "BuildInstanceProfile",
+            roles=[build_instance_role.role_name],
+        )
+
+        # built in the app's VPC with the instance SG, so the build has the
+        # same outbound access as the instances themselves
+        infrastructure = imagebuilder.CfnInfrastructureConfiguration(
+            self,
+            "BuildInfrastructure",
+            name=params.name_prefix + "-build-infrastructure",
+            instance_profile_name=build_instance_profile.ref,
+            instance_types=[params.admin_instance_type],
+            subnet_id=vpc.select_subnets(
+                subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
+            ).subnet_ids[0],
+            security_group_ids=[instance_sg.security_group_id],
+            terminate_instance_on_failure=True,
+        )
+
+        # builds the first image during the deployment, so the compute stack
+        # has an AMI to launch from as soon as this stack is deployed
+        image = imagebuilder.CfnImage(
+            self,
+            "Image",
+            image_recipe_arn=recipe.attr_arn,
+            infrastructure_configuration_arn=infrastructure.attr_arn,
+        )
+
+        # rebuilds, on the schedule or run from the console, are published
+        # to the parameter by a function, which also creates it, so that
+        # CloudFormation never holds a value that a rebuild has replaced
+        pipeline_schedule = None
+        if params.image_rebuild_schedule:
+            pipeline_schedule = imagebuilder.CfnImagePipeline.ScheduleProperty(
+                schedule_expression=params.image_rebuild_schedule,
+                pipeline_execution_start_condition="EXPRESSION_MATCH_ONLY",
+            )
+        imagebuilder.CfnImagePipeline(
+            self,
+            "ImagePipeline",
+            name=params.name_prefix + "-pipeline",
+            image_recipe_arn=recipe.attr_arn,
+            infrastructure_configuration_arn=infrastructure.attr_arn,
+            schedule=pipeline_schedule,
+        )
+
+        # image ARNs use the lower case recipe name
+        recipe_arn_name = (params.name_prefix + "-recipe").lower()
+        publish_ami_lambda = aws_lambda.Function(
+            self,
+            "PublishAmiHandler",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            architecture=aws_lambda.Architecture.ARM_64,
+            handler="publish_ami.handler",
+            code=aws_lambda.Code.from_asset("image_builder"),
+            environment={
+                "AMI_PARAMETER": params.image_ami_param,
+                "IMAGE_ARN_PREFIX": "arn:aws:imagebuilder:"
+                + self.region
+                + ":"
+                + self.account
+                + ":image/"
+                + recipe_arn_name
+                + "/",
+            },
+        )
+        publish_ami_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["imagebuilder:GetImage"],
+                effect=iam.Effect.ALLOW,
+                resources=[
+                    "arn:aws:imagebuilder:"
+                    + self.region
+                    + ":"
+                    + self.account
+                    + ":image/"
+                    + recipe_arn_name
+                    + "/*"
+                ],
+            )
+        )
+        publish_ami_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["ssm:PutParameter", "ssm:DeleteParameter"],
+                effect=iam.Effect.ALLOW,
+                resources=[
+                    "arn:aws:ssm:"
+                    + self.region
+                    + ":"
+                    + self.account
+                    + ":parameter"
+                    + params.image_ami_param
+                ],
+            )
+        )
+
+        ami_parameter_provider = cr.Provider(
+            self,
+            "AmiParameterProvider",
+            on_event_handler=publish_ami_lambda,
+            log_retention=logs.RetentionDays.ONE_WEEK,  # default is INFINITE
+        )
+        CustomResource(
+            self,
+            "AmiId",
+            service_token=ami_parameter_provider.service_token,
+            properties={
+                # the parameter name is the physical ID, so renaming it
+                # creates the new parameter and deletes the old one
+                "ParameterName": params.image_ami_param,
+                "ImageArn": image.attr_arn,
+            },
+        )
+
+        events.Rule(
+            self,
+            "ImageAvailableRule",
+            event_pattern=events.EventPattern(
+                source=["aws.imagebuilder"],
+                detail_type=["EC2 Image Builder Image State Change"],
+                detail={"state": {"status": ["AVAILABLE"]}},
+            ),
+            targets=[targets.LambdaFunction(publish_ami_lambda)],
+        )
@@ -12,22 +12,22 @@ import aws_cdk as cdk
 
 from aws_cdk import Aspects
 
+from app_config.parameters import AppParams
+
 
 class NetworkStack(Stack):
     def __init__(
-        self, scope: Construct, construct_id: str, params: map, **kwargs
+        self, scope: Construct, construct_id: str, params: AppParams, **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         self.vpc = ec2.Vpc(
             self,
-            params["app_name"].capitalize()
-            + params["environment"].capitalize()
-            + "Vpc",
-            ip_addresses=ec2.IpAddresses.cidr(params["vpc_cidr_block"]),
+            params.resource_prefix + "Vpc",
+            ip_addresses=ec2.IpAddresses.cidr(params.vpc_cidr_block),
             enable_dns_hostnames=True,
             enable_dns_support=True,
-            nat_gateways=int(params["nat_gateway_count"]),
+            nat_gateways=params.nat_gateway_count,
             subnet_configuration=[
                 ec2.SubnetConfiguration(
                     name="Isolated", subnet_type=ec2.SubnetType.PRIVATE_ISOLATED
@@ -44,7 +44,7 @@ class NetworkStack(Stack):
         # we add this tag so that the database stack can find the VPC
         Aspects.of(self.vpc).add(
             cdk.Tag(
-                params["app_name"] + "-" + params["environment"] + "-network-stack",
+                params.network_stack_name,
                 "vpc",
             )
         )
@@ -56,10 +56,10 @@ class NetworkStack(Stack):
         )
 
         self.vpc.add_flow_log(
-            "VpcFlowLogs" + params["environment"],
+            "VpcFlowLogs" + params.environment,
             destination=ec2.FlowLogDestination.to_cloud_watch_logs(
                 log_group=logs.LogGroup(
-                    self, "VpcFlowLogsLogGroup" + params["environment"]
+                    self, "VpcFlowLogsLogGroup" + params.environment
                 ),
                 iam_role=vpc_fl_role,
             ),
@@ -90,16 +90,30 @@ class NetworkStack(Stack):
 
         self.db_security_group.add_ingress_rule(
             peer=self.instance_security_group,
-            connection=ec2.Port.tcp(3306),
+            connection=ec2.Port.tcp(params.db_port),
             description="Instances to Aurora",
         )
 
         self.instance_security_group.add_egress_rule(
             peer=self.db_security_group,
-            connection=ec2.Port.tcp(3306),
+            connection=ec2.Port.tcp(params.db_port),
             description="Instances to Aurora",
         )
 
+        # the RDS proxy shares the database SG, so it has to be able to reach itself
+        if params.db_proxy:
+            self.db_security_group.add_ingress_rule(
+                peer=self.db_security_group,
+                connection=ec2.Port.tcp(params.db_port),
+                description="RDS proxy to database",
+            )
+
+            self.db_security_group.add_egress_rule(
+                peer=self.db_security_group,
+                connection=ec2.Port.tcp(params.db_port),
+                description="RDS proxy to database",
+            )
+
         self.instance_security_group.add_ingress_rule(
             peer=self.alb_security_group,
             connection=ec2.Port.tcp(1880),
@@ -107,11 +121,33 @@ class NetworkStack(Stack):
         )
 
         self.alb_security_group.add_ingress_rule(
-            peer=ec2.Peer.prefix_list(params["cloudfront_prefix"]),
+            peer=ec2.Peer.prefix_list(params.cloudfront_prefix),
             connection=ec2.Port.tcp(443),
             description="CloudFront on port 443",
         )
 
+        self.cache_security_group = None
+        if params.cache_engine:
+            self.cache_security_group = ec2.SecurityGroup(
+                self,
+                "CacheSecurityGroup",
+                vpc=self.vpc,
+                allow_all_outbound=False,
+                description="ElastiCache SG",
+            )
+
+            self.cache_security_group.add_ingress_rule(
+                peer=self.instance_security_group,
+                connection=ec2.Port.tcp(params.cache_port),
+                description="Instances to ElastiCache",
+            )
+
+            self.instance_security_group.add_egress_rule(
+                peer=self.cache_security_group,
+                connection=ec2.Port.tcp(params.cache_port),
+                description="Instances to ElastiCache",
+            )
+
         ssm_security_group = ec2.SecurityGroup(
             self,
             "SsmSecurityGroup",
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Synth performance benchmark. Builds and synths the stacks for one or more
+# [app-env] stanzas with stubbed AWS lookups (no network or credentials
+# needed) and records, separately:
+#
+#   import     loading aws_cdk, cdk_nag and the app stacks (jsii runtime startup)
+#   build      constructing each stack
+#   aspects    running the cdk-nag rule packs during synth
+#   synth      app.synth() without cdk-nag
+#
+# The aspects figure is the difference between a synth with cdk-nag and one
+# without. Each run is appended as one JSON line to the output file so
+# regressions can be tracked over time.
+#
+#   python3 benchmark.py                          the [default] stanza
+#   python3 benchmark.py wp-dev nodered-dev -n 3  these stanzas, 3 iterations each
+
+import argparse
+import configparser
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from importlib import metadata
+
+import boto3
+
+from app_config.cdk_context import load_context
+from app_config.parameters import load_params
+from app_config.resolver import LookupResolver, stubbed_clients
+
+STUB_ACCOUNT = "123456789012"
+
+
+def package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def git_commit() -> str:
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    return result.stdout.strip() or "unknown"
+
+
+def stub_lookups(session: boto3.session.Session, params) -> tuple:
+    resolver = LookupResolver(
+        session=session,
+        clients=stubbed_clients(
+            session,
+            params.aws_region,
+            params.hosted_zone,
+            alb_hostname_param=params.alb_hostname_param,
+            alb_hostname="stub-alb.example.com",
+        ),
+    )
+    lookups = resolver.resolve(resolver.app_lookups(params))
+    return lookups, {name: elapsed for name, (elapsed, _) in resolver.timings.items()}
+
+
+def synth_once(cdk, app_module, params, lookups: dict, context: dict, nag: bool):
+    stack_timings = {}
+    with tempfile.TemporaryDirectory() as outdir:
+        app = cdk.App(context=context, outdir=outdir)
+        start = time.perf_counter()
+        app_module.build_app(app, params, lookups, nag=nag, timings=stack_timings)
+        built = time.perf_counter()
+        app.synth()
+        synthed = time.perf_counter()
+    return {
+        "build": built - start,
+        "synth": synthed - built,
+        "stacks": stack_timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark synth performance")
+    parser.add_argument(
+        "sections", nargs="*", help="stanzas to benchmark (default: [default])"
+    )
+    parser.add_argument("-n", "--iterations", type=int, default=1)
+    parser.add_argument("-o", "--output", default="benchmark-results.jsonl")
+    args = parser.parse_args()
+
+    # lookups are stubbed, so any account will do
+    os.environ.setdefault("CDK_DEFAULT_ACCOUNT", STUB_ACCOUNT)
+    os.environ.setdefault("CDK_DEFAULT_REGION", "us-east-1")
+
+    config = configparser.ConfigParser()
+    config.read("parameters.properties")
+    sections = args.sections or [
+        config["default"]["app"] + "-" + config["default"]["env"]
+    ]
+
+    imports = {}
+    start = time.perf_counter()
+    import aws_cdk as cdk
+
+    imports["aws_cdk"] = time.perf_counter() - start
+    start = time.perf_counter()
+    import cdk_nag
+
+    imports["cdk_nag"] = time.perf_counter() - start
+    start = time.perf_counter()
+    import app as app_module
+
+    imports["app"] = time.perf_counter() - start
+
+    session = boto3.session.Session()
+    context = load_context()
+    record = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "aws-cdk-lib": package_version("aws-cdk-lib"),
+        "cdk-nag": package_version("cdk-nag"),
+        "import": imports,
+        "stanzas": {},
+    }
+
+    for section in sections:
+        app_name, environment = section.rsplit("-", 1)
+        params = load_params(config, app_name, environment)
+        lookups, lookup_timings = stub_lookups(session, params)
+        iterations = []
+        for _ in range(args.iterations):
+            without_nag = synth_once(
+                cdk, app_module, params, lookups, context, nag=False
+            )
+            with_nag = synth_once(cdk, app_module, params, lookups, context, nag=True)
+            iterations.append(
+                {
+                    "build": without_nag["build"],
+                    "stacks": without_nag["stacks"],
+                    "synth": without_nag["synth"],
+                    "aspects": max(0.0, with_nag["synth"] - without_nag["synth"]),
+                    "synth_with_nag": with_nag["synth"],
+                }
+            )
+        record["stanzas"][section] = {
+            "lookups": lookup_timings,
+            "iterations": iterations,
+            "median": {
+                phase: statistics.median(iteration[phase] for iteration in iterations)
+                for phase in ("build", "synth", "aspects", "synth_with_nag")
+            },
+        }
+
+    with open(args.output, "a") as output_file:
+        output_file.write(json.dumps(record) + "\n")
+
+    print(
+        "import: "
+        + ", ".join("{} {:.2f}s".format(name, value) for name, value in imports.items())
+    )
+    print(
+        "{:<24} {:>9} {:>9} {:>9} {:>9}".format(
+            "stanza", "build s", "synth s", "aspects s", "total s"
+        )
+    )
+    for section, results in record["stanzas"].items():
+        median = results["median"]
+        print(
+            "{:<24} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                section,
+                median["build"],
+                median["synth"],
+                median["aspects"],
+                median["build"] + median["synth_with_nag"],
+            )
+        )
+        for stack, elapsed in results["iterations"][-1]["stacks"].items():
+            print("  {:<22} {:>9.2f}".format(stack, elapsed))
+    print("Results appended to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Invoked by SQS with the paths the admin instance's invalidate-cdn script
+# has queued over the batching window, and turns them all into a single
+# CloudFront invalidation. With too many invalidations in progress it backs
+# off and tries again for as long as the function may run, and any other
+# error returns the whole batch to the queue to be retried.
+
+import logging
+import os
+import time
+
+import boto3
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+cloudfront_client = boto3.client("cloudfront")
+
+# CloudFront allows 15 paths with wildcards in progress per distribution
+MAX_WILDCARD_PATHS = 15
+# time left to the function timeout below which it stops backing off
+RETRY_MARGIN_MS = 10000
+
+
+def coalesce(paths: set, max_paths: int) -> list:
+    paths = {path if path.startswith("/") else "/" + path for path in paths}
+    # CloudFront only allows a * at the end of a path
+    for path in sorted(paths):
+        if "*" in path[:-1]:
+            logger.warning("Ignoring invalid path " + path)
+            paths.discard(path)
+    prefixes = [path[:-1] for path in paths if path.endswith("*")]
+    # drop paths a wildcard already covers
+    paths = {
+        path
+        for path in paths
+        if not any(
+            path.startswith(prefix) and path != prefix + "*" for prefix in prefixes
+        )
+    }
+    wildcard_paths = [path for path in paths if path.endswith("*")]
+    if len(paths) > max_paths or len(wildcard_paths) > MAX_WILDCARD_PATHS:
+        return ["/*"]
+    return sorted(paths)
+
+
+def create_invalidation(items: list, context) -> dict:
+    delay = 1
+    while True:
+        try:
+            return cloudfront_client.create_invalidation(
+                DistributionId=os.environ["DISTRIBUTION_ID"],
+                InvalidationBatch={
+                    "Paths": {"Quantity": len(items), "Items": items},
+                    "CallerReference": context.aws_request_id,
+                },
+            )["Invalidation"]
+        except cloudfront_client.exceptions.TooManyInvalidationsInProgress:
+            # the in progress invalidations finish within minutes, so wait
+            # here rather than use up the messages' receives
+            remaining = context.get_remaining_time_in_millis()
+            if remaining < RETRY_MARGIN_MS + delay * 1000:
+                raise
+            logger.info(
+                "Too many invalidations in progress, retrying in {}s".format(delay)
+            )
+            time.sleep(delay)
+            delay = min(delay * 2, 16)
+
+
+def handler(event, context):
+    paths = set()
+    for record in event["Records"]:
+        paths.update(record["body"].split())
+    items = coalesce(paths, int(os.environ["MAX_PATHS"]))
+    if not items:
+        return
+    invalidation = create_invalidation(items, context)
+    logger.info(
+        "Invalidation {} for {} paths from {} messages: {}".format(
+            invalidation["Id"], len(items), len(event["Records"]), " ".join(items)
+        )
+    )
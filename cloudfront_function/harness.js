@@ -0,0 +1,120 @@
+#!/usr/bin/env node
+
+// Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+// SPDX-License-Identifier: MIT-0
+
+// Runs the viewer request function against sample events and checks the
+// results, without deploying anything.
+//
+//   node cloudfront_function/harness.js                      the sample cases.json
+//   node cloudfront_function/harness.js my-cases.json
+//   node cloudfront_function/harness.js --code /tmp/wp-dev.js my-cases.json
+//
+// A cases file has the "config" viewer_request.js is rendered with (ignored
+// with --code, which runs already generated code, eg from
+// python3 -m app_config.edge_function wp-dev) and a list of "cases":
+//
+//   {"name": "...",
+//    "request": {"uri": "/", "querystring": "a=1", "ip": "192.0.2.1", "headers": {"host": "..."}},
+//    "expect": {"statusCode": 301, "headers": {"location": {"value": "..."}}}}
+//
+// "expect" is compared with the returned request or response, only the keys
+// it has are checked, and null means the key must not be there.
+
+'use strict';
+
+const fs = require('fs');
+const path = require('path');
+const vm = require('vm');
+
+function loadHandler(code) {
+    const context = {};
+    vm.runInNewContext(code + '\nthis.handler = handler;', context);
+    return context.handler;
+}
+
+function parseQueryString(querystring) {
+    const parsed = {};
+    for (const pair of (querystring || '').split('&').filter(Boolean)) {
+        const [name, value = ''] = pair.split('=');
+        if (parsed[name]) {
+            parsed[name].multiValue = parsed[name].multiValue || [{value: parsed[name].value}];
+            parsed[name].multiValue.push({value: value});
+        } else {
+            parsed[name] = {value: value};
+        }
+    }
+    return parsed;
+}
+
+// builds an event like the ones CloudFront passes to a function
+function viewerRequestEvent(request) {
+    const headers = {};
+    for (const [name, value] of Object.entries(request.headers || {})) {
+        headers[name.toLowerCase()] = {value: value};
+    }
+    return {
+        version: '1.0',
+        context: {eventType: 'viewer-request'},
+        viewer: {ip: request.ip || '198.51.100.1'},
+        request: {
+            method: request.method || 'GET',
+            uri: request.uri || '/',
+            querystring: parseQueryString(request.querystring),
+            headers: headers,
+            cookies: {},
+        },
+    };
+}
+
+function mismatches(expected, actual, where) {
+    if (expected === null) {
+        return actual === undefined ? [] : [where + ' should not be there'];
+    }
+    if (typeof expected !== 'object') {
+        return expected === actual
+            ? []
+            : [where + ' is ' + JSON.stringify(actual) + ', expected ' + JSON.stringify(expected)];
+    }
+    if (actual === null || typeof actual !== 'object') {
+        return [where + ' is ' + JSON.stringify(actual) + ', expected an object'];
+    }
+    return Object.keys(expected).flatMap((key) =>
+        mismatches(expected[key], actual[key], where + '.' + key)
+    );
+}
+
+function main(args) {
+    let codeFile = null;
+    if (args[0] === '--code') {
+        codeFile = args[1];
+        args = args.slice(2);
+    }
+    const casesFile = args[0] || path.join(__dirname, 'cases.json');
+    const cases = JSON.parse(fs.readFileSync(casesFile, 'utf8'));
+
+    const code = codeFile
+        ? fs.readFileSync(codeFile, 'utf8')
+        : fs
+              .readFileSync(path.join(__dirname, 'viewer_request.js'), 'utf8')
+              .replace('var config = CONFIG;', 'var config = ' + JSON.stringify(cases.config) + ';');
+    const handler = loadHandler(code);
+
+    let failures = 0;
+    for (const testCase of cases.cases) {
+        // each case gets a fresh event, the function modifies it in place
+        const result = handler(viewerRequestEvent(testCase.request));
+        const problems = mismatches(testCase.expect, result, 'result');
+        if (problems.length) {
+            failures++;
+            console.log('FAIL ' + testCase.name);
+            problems.forEach((problem) => console.log('     ' + problem));
+        } else {
+            console.log('ok   ' + testCase.name);
+        }
+    }
+    console.log(cases.cases.length - failures + '/' + cases.cases.length + ' passed');
+    return failures ? 1 : 0;
+}
+
+process.exitCode = main(process.argv.slice(2));
@@ -0,0 +1,119 @@
+// Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+// SPDX-License-Identifier: MIT-0
+
+// The viewer request CloudFront Function for the default and uncached
+// behaviors. app_config/edge_function.py replaces CONFIG with the settings
+// for a stanza, and harness.js runs it locally against sample events.
+// CloudFront Functions are ES5.1 (cloudfront-js-1.0), so no let/const.
+
+var config = CONFIG;
+
+function matchesPattern(value, pattern) {
+    if (pattern.charAt(pattern.length - 1) === '*') {
+        return value.indexOf(pattern.slice(0, -1)) === 0;
+    }
+    return value === pattern;
+}
+
+function matchesAny(value, patterns) {
+    for (var i = 0; i < patterns.length; i++) {
+        if (matchesPattern(value, patterns[i])) {
+            return true;
+        }
+    }
+    return false;
+}
+
+function ipv4Number(ip) {
+    var parts = ip.split('.');
+    if (parts.length !== 4) {
+        return null;
+    }
+    return (((+parts[0] << 24) | (+parts[1] << 16) | (+parts[2] << 8) | +parts[3]) >>> 0);
+}
+
+function isAdminIp(ip) {
+    if (config.adminIps.indexOf(ip) !== -1) {
+        return true;
+    }
+    var number = ipv4Number(ip);
+    if (number === null) {
+        return false;
+    }
+    for (var i = 0; i < config.adminNetworks.length; i++) {
+        var network = config.adminNetworks[i];
+        if (((number & network[1]) >>> 0) === network[0]) {
+            return true;
+        }
+    }
+    return false;
+}
+
+function queryString(querystring) {
+    var pairs = [];
+    for (var name in querystring) {
+        var parameter = querystring[name];
+        var values = parameter.multiValue || [parameter];
+        for (var i = 0; i < values.length; i++) {
+            pairs.push(values[i].value === '' ? name : name + '=' + values[i].value);
+        }
+    }
+    return pairs.length ? '?' + pairs.join('&') : '';
+}
+
+function response(statusCode, statusDescription, location) {
+    var headers = {};
+    if (location) {
+        headers['location'] = {value: location};
+    }
+    return {statusCode: statusCode, statusDescription: statusDescription, headers: headers};
+}
+
+function handler(event) {
+    var request = event.request;
+    var headers = request.headers;
+    var uri = request.uri;
+
+    // the ALB's write rule trusts this header, so it must come from here
+    for (var i = 0; i < config.strippedHeaders.length; i++) {
+        delete headers[config.strippedHeaders[i]];
+    }
+    headers['true-client-ip'] = {value: event.viewer.ip};
+
+    // the same answer the fleet gives, without the trip to the origin
+    if (matchesAny(uri, config.adminPaths) && !isAdminIp(event.viewer.ip)) {
+        return response(403, 'Forbidden');
+    }
+
+    // remove tracking parameters, so they aren't part of the cache key
+    var querystring = request.querystring;
+    for (var name in querystring) {
+        if (matchesAny(name.toLowerCase(), config.strippedQueryStrings)) {
+            delete querystring[name];
+        }
+    }
+
+    var target = config.redirects[uri];
+    if (target !== undefined) {
+        return response(301, 'Moved Permanently', target + queryString(querystring));
+    }
+
+    var host = headers.host ? headers.host.value : '';
+    var normalizedHost = config.lowercaseHost ? host.toLowerCase() : host;
+    var normalizedUri = uri;
+    var lastSegment = uri.slice(uri.lastIndexOf('/') + 1);
+    if (config.trailingSlash === 'add' && lastSegment !== '' && lastSegment.indexOf('.') === -1) {
+        normalizedUri = uri + '/';
+    } else if (config.trailingSlash === 'remove' && uri.length > 1 && lastSegment === '') {
+        normalizedUri = uri.replace(/\/+$/, '') || '/';
+    }
+    if (normalizedUri !== uri || normalizedHost !== host) {
+        return response(
+            301,
+            'Moved Permanently',
+            'https://' + normalizedHost + normalizedUri + queryString(querystring)
+        );
+    }
+
+    return request;
+}
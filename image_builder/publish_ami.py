@@ -0,0 +1,65 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Invoked by EventBridge when an EC2 Image Builder image becomes available.
+# If the image was built from this app's recipe, its AMI ID is written to
+# the parameter the compute stack launches instances from.
+#
+# This function is the parameter's only writer. It is also the image stack's
+# custom resource handler, which creates the parameter with the image built
+# during the first deployment and deletes it with the stack. Updates leave
+# the value alone: a rebuild may have published a newer AMI since, and an
+# image replaced by a deployment is published by its own event.
+
+import logging
+import os
+
+import boto3
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+imagebuilder_client = boto3.client("imagebuilder")
+ssm_client = boto3.client("ssm")
+
+
+def publish(image_arn: str, parameter_name: str):
+    image = imagebuilder_client.get_image(imageBuildVersionArn=image_arn)["image"]
+    ami_id = image["outputResources"]["amis"][0]["image"]
+    ssm_client.put_parameter(
+        Name=parameter_name,
+        Description="AMI baked by " + image_arn,
+        Value=ami_id,
+        Type="String",
+        Overwrite=True,
+        Tier="Standard",
+    )
+    logger.info("Set " + parameter_name + " to " + ami_id)
+
+
+def on_event(event):
+    properties = event["ResourceProperties"]
+    parameter_name = properties["ParameterName"]
+    old_name = event.get("OldResourceProperties", {}).get("ParameterName")
+    if event["RequestType"] == "Create" or (
+        event["RequestType"] == "Update" and old_name != parameter_name
+    ):
+        publish(properties["ImageArn"], parameter_name)
+    elif event["RequestType"] == "Delete":
+        # also sent for the old name, after a rename
+        try:
+            ssm_client.delete_parameter(Name=parameter_name)
+        except ssm_client.exceptions.ParameterNotFound:
+            pass
+    else:
+        logger.info("Leaving " + parameter_name + " as it is")
+    return {"PhysicalResourceId": parameter_name}
+
+
+def handler(event, context):
+    if "RequestType" in event:
+        return on_event(event)
+    image_arn = event["resources"][0]
+    if not image_arn.startswith(os.environ["IMAGE_ARN_PREFIX"]):
+        logger.info("Ignoring image " + image_arn)
+        return
+    publish(image_arn, os.environ["AMI_PARAMETER"])
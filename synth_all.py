@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Synth many (or all) [app-env] stanzas of parameters.properties in one run.
+#
+#   python3 synth_all.py                       every stanza
+#   python3 synth_all.py nodered-dev wp-dev    just these stanzas
+#   python3 synth_all.py --diff                then run cdk diff against each assembly
+#
+# Lookups for every stanza are resolved once, concurrently, in this process.
+# The stanzas are then synthed on a pool of worker processes, each of which
+# starts the jsii runtime once and reuses it for every stanza it is given.
+# Each stanza gets its own cloud assembly in <outdir>/<app-env>.
+
+import argparse
+import configparser
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import boto3
+
+from app_config.cdk_context import load_context
+from app_config.lookup_cache import LookupCache
+from app_config.nag_cache import NAG_MODES
+from app_config.parameters import (
+    ParameterError,
+    environment_sections,
+    load_params,
+)
+from app_config.resolver import LookupResolver
+
+
+def synth_section(
+    section: str, app_name: str, environment: str, outdir: str, context: dict
+):
+    try:
+        start = time.perf_counter()
+        # the first section each worker synths pays for the jsii runtime startup
+        import app
+
+        imported = time.perf_counter()
+        section_context = dict(context)
+        section_context.update(
+            {"app": app_name, "env": environment, "offline-lookups": "true"}
+        )
+        app.main(context=section_context, outdir=outdir)
+        return section, imported - start, time.perf_counter() - imported, None
+    except Exception:
+        return section, 0.0, 0.0, traceback.format_exc()
+
+
+def diff_section(section: str, outdir: str):
+    result = subprocess.run(
+        ["cdk", "diff", "--app", outdir],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    return section, result.returncode, result.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Synth several app-env stanzas of parameters.properties"
+    )
+    parser.add_argument(
+        "sections", nargs="*", help="stanzas to synth, eg wp-dev (default: all)"
+    )
+    parser.add_argument("--outdir", default="cdk.out")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--refresh-lookups",
+        action="store_true",
+        help="ignore cached lookups and query AWS again",
+    )
+    parser.add_argument(
+        "--nag",
+        choices=NAG_MODES,
+        help="cdk-nag mode for every stanza (default: from cdk.json or CDK_NAG_MODE)",
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="run cdk diff against each synthesized assembly",
+    )
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read("parameters.properties")
+
+    try:
+        sections = [
+            (section, app_name, environment)
+            for section, app_name, environment in environment_sections(config)
+            if not args.sections or section in args.sections
+        ]
+    except ParameterError as e:
+        sys.exit(str(e))
+    unknown = set(args.sections) - set(section for section, _, _ in sections)
+    if unknown:
+        sys.exit("Unknown stanzas: " + ", ".join(sorted(unknown)))
+
+    session = boto3.session.Session()
+    # the cdk CLI sets these for app.py, we have to do it ourselves
+    if "CDK_DEFAULT_REGION" not in os.environ and session.region_name:
+        os.environ["CDK_DEFAULT_REGION"] = session.region_name
+    if "CDK_DEFAULT_ACCOUNT" not in os.environ:
+        os.environ["CDK_DEFAULT_ACCOUNT"] = session.client(
+            "sts"
+        ).get_caller_identity()["Account"]
+
+    # resolve every stanza's lookups in one concurrent pass, so the workers
+    # can run with offline lookups
+    start = time.perf_counter()
+    lookup_cache = LookupCache(refresh=args.refresh_lookups)
+    resolver = LookupResolver(session=session, cache=lookup_cache)
+    lookups = {}
+    for section, app_name, environment in sections:
+        try:
+            params = load_params(config, app_name, environment)
+        except ParameterError as e:
+            sys.exit(str(e))
+        for name, lookup in resolver.app_lookups(params).items():
+            lookups[section + "/" + name] = lookup
+    resolver.resolve(lookups)
+    lookup_cache.save()
+    print("Resolved lookups in {:.1f}s".format(time.perf_counter() - start))
+
+    context = load_context()
+    if args.nag:
+        context["nag"] = args.nag
+    results = {}
+    start = time.perf_counter()
+    # spawn rather than fork, a forked jsii kernel pipe can't be shared safely
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(args.workers, len(sections))),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        futures = [
+            executor.submit(
+                synth_section,
+                section,
+                app_name,
+                environment,
+                os.path.join(args.outdir, section),
+                context,
+            )
+            for section, app_name, environment in sections
+        ]
+        for future in as_completed(futures):
+            section, import_time, synth_time, error = future.result()
+            results[section] = (import_time, synth_time, error)
+            if error:
+                print("{} failed:\n{}".format(section, error))
+    total = time.perf_counter() - start
+
+    print("")
+    print("{:<30} {:>10} {:>10}  {}".format("stanza", "import s", "synth s", "status"))
+    for section, _, _ in sections:
+        import_time, synth_time, error = results[section]
+        print(
+            "{:<30} {:>10.1f} {:>10.1f}  {}".format(
+                section, import_time, synth_time, "failed" if error else "ok"
+            )
+        )
+    print("{:<30} {:>21.1f}".format("total (wall clock)", total))
+
+    failed = [section for section in results if results[section][2]]
+
+    if args.diff:
+        synthed = [section for section, _, _ in sections if section not in failed]
+        with ThreadPoolExecutor(max_workers=max(1, len(synthed))) as executor:
+            diffs = list(
+                executor.map(
+                    lambda section: diff_section(
+                        section, os.path.join(args.outdir, section)
+                    ),
+                    synthed,
+                )
+            )
+        for section, _, output in diffs:
+            print("\n===== " + section + " =====")
+            print(output)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@
  
 #configure apache
 echo "# added by ImageBuilder
-<Directory \"/var/www/html\">
+<Directory \"{app_dir}\">
   AllowOverride All
   <IfModule mod_rewrite.c>
     RewriteEngine On
@@ -28,7 +28,7 @@ deny from all
 <location /wp-login.php>
 deny from all
 </location>
-<Directory \"/var/www/html/wp-admin\">
+<Directory \"{app_dir}/wp-admin\">
   AllowOverride AuthConfig
 </Directory>
 # Directory on the disk to contain cached files 
@@ -42,6 +42,91 @@ ExpiresDefault \"access plus 15 minutes\"
 <FilesMatch \"\.(php)$\">
     ExpiresActive Off
 </FilesMatch>" > /etc/httpd/conf.d/wordpress.conf
+# serve the app from {app_dir}, which is a local copy of EFS with fleetLocalSync
+sed -i -E -e 's|^DocumentRoot .*|DocumentRoot "{app_dir}"|' \
+  -e 's|^<Directory "/var/www/html">|<Directory "{app_dir}">|' /etc/httpd/conf/httpd.conf
+if [ "{app_dir}" != "{efs_mount_dir}" ]
+then
+  # uploads change without app-publish, so they are served from EFS rather
+  # than the copy, which leaves them out with fleetSyncExclude
+  echo "# added by user data
+Alias /wp-content/uploads \"{efs_mount_dir}/wp-content/uploads\"
+<Directory \"{efs_mount_dir}/wp-content/uploads\">
+  AllowOverride None
+  Options -Indexes
+  Require all granted
+  <FilesMatch \"\.(php|phtml)$\">
+    Require all denied
+  </FilesMatch>
+</Directory>" > /etc/httpd/conf.d/uploads.conf
+fi
 
+# size Apache, PHP-FPM and OPcache for the ASG's instance type. like all user
+# data this only runs on the first boot, and the values are worked out at synth
+# time, so change the instance type in the properties file, which replaces the
+# instances, rather than on a stopped instance. PHP runs in PHP-FPM, so Apache
+# can use the event MPM
+echo "LoadModule mpm_event_module modules/mod_mpm_event.so" > /etc/httpd/conf.modules.d/00-mpm.conf
+echo "# added by user data, sized for {vcpus} vCPUs and {memory_mb} MiB
+<IfModule mpm_event_module>
+  ServerLimit {apache_server_limit}
+  StartServers 2
+  ThreadsPerChild {apache_threads_per_child}
+  MaxRequestWorkers {apache_max_request_workers}
+  MinSpareThreads 25
+  MaxSpareThreads 75
+  MaxConnectionsPerChild 0
+</IfModule>" > /etc/httpd/conf.d/tuning.conf
+sed -i -E -e "s/^;?pm = .*/pm = {php_pm}/" \
+  -e "s/^;?pm.max_children = .*/pm.max_children = {php_max_children}/" \
+  -e "s/^;?pm.start_servers = .*/pm.start_servers = {php_start_servers}/" \
+  -e "s/^;?pm.min_spare_servers = .*/pm.min_spare_servers = {php_min_spare_servers}/" \
+  -e "s/^;?pm.max_spare_servers = .*/pm.max_spare_servers = {php_max_spare_servers}/" \
+  -e "s/^;?pm.max_requests = .*/pm.max_requests = {php_max_requests}/" /etc/php-fpm.d/www.conf
+echo "; added by user data
+opcache.enable=1
+opcache.memory_consumption={opcache_memory_mb}
+opcache.interned_strings_buffer={opcache_interned_strings_mb}
+opcache.max_accelerated_files={opcache_max_files}" > /etc/php.d/99-tuning.ini
+# keep Apache's page cache in memory rather than on the root volume, with
+# htcacheclean keeping it within the tmpfs
+mkdir -p /var/cache/httpd/proxy
+if ! grep -q /var/cache/httpd/proxy /etc/fstab
+then
+  echo "tmpfs /var/cache/httpd/proxy tmpfs size={page_cache_mb}m,mode=0700,uid=apache,gid=apache 0 0" >> /etc/fstab
+fi
+mount /var/cache/httpd/proxy
+echo "INTERVAL=5
+CACHE_ROOT=/var/cache/httpd/proxy
+LIMIT=$(({page_cache_mb} * 3 / 4))M
+OPTIONS=-n" > /etc/sysconfig/htcacheclean
+systemctl restart htcacheclean
+# the fleet never changes the code, so OPcache doesn't need to check the
+# files for changes. app-refresh reloads PHP-FPM instead, when the admin
+# instance publishes code with app-publish
+echo "; added by user data
+opcache.validate_timestamps=0" > /etc/php.d/99-fleet.ini
+if [ -n "{opcache_preload_dirs}" ]
+then
+  # compiled, but not run, when PHP-FPM starts
+  echo "<?php
+foreach (explode(' ', '{opcache_preload_dirs}') as \$dir) {{
+  \$files = new RecursiveIteratorIterator(new RecursiveDirectoryIterator('{app_dir}/' . \$dir));
+  foreach (\$files as \$file) {{
+    if (\$file->getExtension() === 'php') {{
+      @opcache_compile_file(\$file->getPathname());
+    }}
+  }}
+}}" > /etc/php-preload.php
+  echo "opcache.preload=/etc/php-preload.php
+opcache.preload_user=apache" >> /etc/php.d/99-fleet.ini
+fi
+# a reload starts PHP-FPM's master again, with an empty OPcache
+cat > /etc/app-refresh.d/50-opcache-reset <<'EOF'
+#!/bin/bash
+systemctl reload php-fpm
+rm -rf /var/cache/httpd/proxy/*
+EOF
+chmod 755 /etc/app-refresh.d/50-opcache-reset
 apachectl restart
 systemctl restart php-fpm
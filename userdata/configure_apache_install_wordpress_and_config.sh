@@ -60,7 +60,11 @@ then
   USERNAME=`echo $SECRET | jq -r '.username'`
   PASSWORD=`echo $SECRET | jq -r '.password'`
   DBNAME=`echo $SECRET | jq -r '.dbname'`
-  HOST=`echo $SECRET | jq -r '.host'`
+  HOST="{db_host}"
+  if [ -z "$HOST" ]
+  then
+    HOST=`echo $SECRET | jq -r '.host'`
+  fi
   KEYS_AND_SALTS=`curl https://api.wordpress.org/secret-key/1.1/salt/`
   echo "<?php
 \$_SERVER['HTTPS']='on';
@@ -85,5 +89,112 @@ require_once ABSPATH . 'wp-settings.php';" > {efs_mount_dir}/wp-config.php
   chmod 440 {efs_mount_dir}/wp-config.php
   rm -f {efs_mount_dir}/wp-config-sample.php
 fi
+# keep DB_HOST in step with the stack, eg when the RDS proxy is turned on or off
+if [ -n "{db_host}" ]
+then
+  sed -i "s/define('DB_HOST', '[^']*');/define('DB_HOST', '{db_host}');/" {efs_mount_dir}/wp-config.php
+fi
+# point the Redis Object Cache plugin at the cache tier if there is one,
+# predis is used as php7.4 from amazon-linux-extras has no phpredis package
+if [ -n "{cache_endpoint}" ] && ! grep -q WP_REDIS_HOST {efs_mount_dir}/wp-config.php
+then
+  sed -i "/^require_once ABSPATH/i define('WP_REDIS_HOST', '{cache_endpoint}');\ndefine('WP_REDIS_PORT', {cache_port});\ndefine('WP_REDIS_SCHEME', 'tls');\ndefine('WP_REDIS_CLIENT', 'predis');" {efs_mount_dir}/wp-config.php
+fi
+# install the plugin and enable its object-cache.php drop-in, as wp redis
+# enable would. WordPress loads the drop-in whether or not the plugin is
+# activated, and wp-cli can't activate it before WordPress is installed
+if [ -n "{cache_endpoint}" ]
+then
+  if [ ! -d {efs_mount_dir}/wp-content/plugins/redis-cache ]
+  then
+    command -v unzip || yum install -y unzip
+    wget -q -O /tmp/redis-cache.zip https://downloads.wordpress.org/plugin/redis-cache.latest-stable.zip
+    unzip -q /tmp/redis-cache.zip -d {efs_mount_dir}/wp-content/plugins
+    rm -f /tmp/redis-cache.zip
+  fi
+  if [ ! -f {efs_mount_dir}/wp-content/object-cache.php ]
+  then
+    cp {efs_mount_dir}/wp-content/plugins/redis-cache/includes/object-cache.php {efs_mount_dir}/wp-content/object-cache.php
+  fi
+  chown -R apache:apache {efs_mount_dir}/wp-content/plugins/redis-cache {efs_mount_dir}/wp-content/object-cache.php
+elif grep -qs "Redis Object Cache" {efs_mount_dir}/wp-content/object-cache.php
+then
+  # the cache has been removed, so stop WordPress trying to reach it
+  rm -f {efs_mount_dir}/wp-content/object-cache.php
+fi
+# copy uploads to the media bucket that CloudFront serves them from
+if [ -n "{media_bucket}" ]
+then
+  echo "* * * * * root aws s3 sync {efs_mount_dir}/wp-content/uploads s3://{media_bucket}/wp-content/uploads --region us-east-1 --only-show-errors" > /etc/cron.d/sync-media
+fi
+# tell the fleet to reload PHP-FPM, which doesn't check the files for
+# changes there, when code is changed from wp-admin as well as with
+# app-publish. The marker is apache's, so WordPress can write it too
+touch {efs_mount_dir}/.code-version
+chown apache:apache {efs_mount_dir}/.code-version
+mkdir -p {efs_mount_dir}/wp-content/mu-plugins
+cat > {efs_mount_dir}/wp-content/mu-plugins/code-version.php <<'EOF'
+<?php
+function app_code_changed() {{
+  file_put_contents(ABSPATH . '.code-version', microtime(true));
+}}
+add_action('upgrader_process_complete', 'app_code_changed');
+add_action('activated_plugin', 'app_code_changed');
+add_action('deactivated_plugin', 'app_code_changed');
+add_action('switch_theme', 'app_code_changed');
+EOF
+chown -R apache:apache {efs_mount_dir}/wp-content/mu-plugins
+# invalidate changed pages in CloudFront when posts are published or updated.
+# the plugin is on EFS, but only the admin instance has invalidate-cdn
+if [ -n "{invalidation_queue_url}" ]
+then
+  mkdir -p {efs_mount_dir}/wp-content/mu-plugins
+  cat > {efs_mount_dir}/wp-content/mu-plugins/invalidate-cdn.php <<'EOF'
+<?php
+function app_invalidate_cdn($paths) {{
+  if (is_executable('/usr/local/bin/invalidate-cdn')) {{
+    exec('/usr/local/bin/invalidate-cdn ' . implode(' ', array_map('escapeshellarg', array_unique($paths))) . ' > /dev/null 2>&1 &');
+  }}
+}}
+add_action('transition_post_status', function ($new_status, $old_status, $post) {{
+  if ($new_status === 'publish' || $old_status === 'publish') {{
+    app_invalidate_cdn(array(wp_make_link_relative(get_permalink($post)), '/', '/feed/'));
+  }}
+}}, 10, 3);
+add_action('wp_update_comment_count', function ($post_id) {{
+  app_invalidate_cdn(array(wp_make_link_relative(get_permalink($post_id))));
+}});
+EOF
+  chown -R apache:apache {efs_mount_dir}/wp-content/mu-plugins
+else
+  rm -f {efs_mount_dir}/wp-content/mu-plugins/invalidate-cdn.php
+fi
+# size Apache, PHP-FPM and OPcache for the ASG's instance type. like all user
+# data this only runs on the first boot, and the values are worked out at synth
+# time, so change the instance type in the properties file, which replaces the
+# instances, rather than on a stopped instance. PHP runs in PHP-FPM, so Apache
+# can use the event MPM
+echo "LoadModule mpm_event_module modules/mod_mpm_event.so" > /etc/httpd/conf.modules.d/00-mpm.conf
+echo "# added by user data, sized for {vcpus} vCPUs and {memory_mb} MiB
+<IfModule mpm_event_module>
+  ServerLimit {apache_server_limit}
+  StartServers 2
+  ThreadsPerChild {apache_threads_per_child}
+  MaxRequestWorkers {apache_max_request_workers}
+  MinSpareThreads 25
+  MaxSpareThreads 75
+  MaxConnectionsPerChild 0
+</IfModule>" > /etc/httpd/conf.d/tuning.conf
+sed -i -E -e "s/^;?pm = .*/pm = {php_pm}/" \
+  -e "s/^;?pm.max_children = .*/pm.max_children = {php_max_children}/" \
+  -e "s/^;?pm.start_servers = .*/pm.start_servers = {php_start_servers}/" \
+  -e "s/^;?pm.min_spare_servers = .*/pm.min_spare_servers = {php_min_spare_servers}/" \
+  -e "s/^;?pm.max_spare_servers = .*/pm.max_spare_servers = {php_max_spare_servers}/" \
+  -e "s/^;?pm.max_requests = .*/pm.max_requests = {php_max_requests}/" /etc/php-fpm.d/www.conf
+echo "; added by user data
+opcache.enable=1
+opcache.memory_consumption={opcache_memory_mb}
+opcache.interned_strings_buffer={opcache_interned_strings_mb}
+opcache.max_accelerated_files={opcache_max_files}" > /etc/php.d/99-tuning.ini
 apachectl restart
 systemctl start php-fpm